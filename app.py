@@ -1,29 +1,53 @@
-from flask import Flask, render_template, flash, redirect, url_for, request, abort, session, jsonify
+from flask import Flask, render_template, flash, redirect, url_for, request, abort, session, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import inspect
+from sqlalchemy import inspect, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import joinedload, with_expression
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from flask_mail import Mail, Message
 from flask_session import Session  # Import Session
+from markupsafe import Markup, escape
 import os
-from datetime import datetime
+import re
+import json
+import math
+import base64
+import sqlite3
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from functools import wraps
-from threading import Thread
+from threading import Thread, Lock
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+import click
 import chatbot
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'nestcircle_secure_key_do_not_share_in_production'  # Consistent secret key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///site.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# SQLite tuning, applied to every connection. SQLITE_PROFILE=default keeps SQLite's own
+# settings and writes from the request threads, as before.
+app.config['SQLITE_PROFILE'] = os.getenv('SQLITE_PROFILE', 'production')
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),  # Readers don't wait for writers
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),  # Durable with WAL except on power loss
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-65536')),  # Negative means KiB, so 64 MB
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),  # Wait for the write lock
+}
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static/uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 
 # Session configuration
 app.config['PERMANENT_SESSION_LIFETIME'] = 60 * 60 * 24 * 7  # 7 days
 app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = os.path.join(app.root_path, 'flask_session')
+app.config['SESSION_FILE_DIR'] = os.getenv('SESSION_FILE_DIR', os.path.join(app.root_path, 'flask_session'))
 # Ensure the session directory exists
 os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
 
@@ -41,9 +65,53 @@ app.config['MAIL_DEFAULT_SENDER'] = ('NestCircle', 'your-email@gmail.com')
 # Initialize database
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if app.config['SQLITE_PROFILE'] != 'production' or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+# SQLite allows one writer at a time. Short write transactions from requests run on this
+# single thread, so they queue here instead of failing with "database is locked", and
+# request threads only ever hold read transactions, which WAL never blocks.
+sqlite_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+
+def run_write(func, *args):
+    """Run func(*args) and commit, as one transaction on the writer thread; returns its result.
+    
+    func gets its own session, so pass ids rather than model instances.
+    """
+    if app.config['SQLITE_PROFILE'] != 'production' or db.engine.dialect.name != 'sqlite':
+        result = func(*args)
+        db.session.commit()
+        return result
+    
+    def write():
+        with app.app_context():
+            try:
+                # Take the write lock up front. A transaction that reads first and then tries
+                # to write fails at once if another process wrote in between.
+                db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+                result = func(*args)
+                db.session.commit()
+                return result
+            except Exception:
+                db.session.rollback()
+                raise
+    return sqlite_writer.submit(write).result()
+
 # Initialize mail
 mail = Mail(app)
 
+# Worker pool for extracting resource text in the background
+ingestion_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ingestion')
+
+# Find a working Gemini model without blocking startup
+chatbot.start_model_initialization()
+
 # Initialize login manager
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -78,7 +146,9 @@ class User(db.Model, UserMixin):
 # Association table for Resource-Category many-to-many relationship
 resource_categories = db.Table('resource_categories',
     db.Column('resource_id', db.Integer, db.ForeignKey('resource.id'), primary_key=True),
-    db.Column('category_id', db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    db.Column('category_id', db.Integer, db.ForeignKey('category.id'), primary_key=True),
+    # The primary key starts with resource_id, this one serves the category listings
+    db.Index('ix_resource_categories_category_id', 'category_id', 'resource_id')
 )
 
 class Category(db.Model):
@@ -86,11 +156,16 @@ class Category(db.Model):
     name = db.Column(db.String(50), unique=True, nullable=False)
     description = db.Column(db.String(150), nullable=True)
     resources = db.relationship('Resource', secondary=resource_categories, 
-                              backref=db.backref('categories', lazy='dynamic'))
+                              backref=db.backref('categories', lazy='select'))
     
     def __repr__(self):
         return f"Category('{self.name}')"
 
+class CacheVersion(db.Model):
+    """Change counter for data that worker processes cache in memory, e.g. the categories."""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 class Resource(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -103,12 +178,34 @@ class Resource(db.Model):
     comments = db.relationship('Comment', backref='resource', lazy=True, cascade="all, delete-orphan", 
                               order_by="desc(Comment.date_posted)")
     bookmarks = db.relationship('Bookmark', backref='resource', lazy=True, cascade="all, delete-orphan")
-    
-    @property
+    extracted_text = db.relationship('ResourceText', backref='resource', uselist=False, cascade="all, delete-orphan")
+    # Rating aggregates, kept in step with the Rating rows by rate_resource
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Stored average so the top rated listing and the minimum rating filter can use an index
+    rating_avg = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    # How well the resource matched a full-text search, set only on search results
+    search_score = db.query_expression()
+    
+    @hybrid_property
     def avg_rating(self):
-        if not self.ratings:
+        if not self.rating_count:
             return 0
-        return sum(r.rating for r in self.ratings) / len(self.ratings)
+        return self.rating_sum / self.rating_count
+    
+    @avg_rating.expression
+    def avg_rating(cls):
+        # Usable in SQL, e.g. order_by(Resource.avg_rating.desc())
+        return cls.rating_avg
+    
+    # Indexes matching the listing orders in RESOURCE_SORTS, alone and after the common filters
+    __table_args__ = (
+        db.Index('ix_resource_date_posted', 'date_posted', 'id'),
+        db.Index('ix_resource_type_date_posted', 'resource_type', 'date_posted', 'id'),
+        db.Index('ix_resource_user_id_date_posted', 'user_id', 'date_posted', 'id'),
+        db.Index('ix_resource_rating_count', 'rating_count', 'date_posted', 'id'),
+        db.Index('ix_resource_rating_avg', 'rating_avg', 'rating_count', 'date_posted', 'id'),
+    )
     
     def __repr__(self):
         return f"Resource('{self.title}', '{self.date_posted}')"
@@ -122,7 +219,10 @@ class Rating(db.Model):
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False)
     
     # Make sure a user can only rate a resource once
-    __table_args__ = (db.UniqueConstraint('user_id', 'resource_id', name='user_resource_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'resource_id', name='user_resource_uc'),
+        db.Index('ix_rating_resource_id', 'resource_id'),
+    )
 
 class Token(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -132,6 +232,8 @@ class Token(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=False)
     
+    __table_args__ = (db.Index('ix_token_user_id_type', 'user_id', 'type'),)
+    
     def is_expired(self):
         return datetime.utcnow() > self.expires_at
 
@@ -142,6 +244,8 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False)
     
+    __table_args__ = (db.Index('ix_comment_resource_id_date_posted', 'resource_id', 'date_posted', 'id'),)
+    
     def __repr__(self):
         return f"Comment('{self.content[:20]}...', '{self.date_posted}')"
 
@@ -151,12 +255,96 @@ class Bookmark(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False)
     
-    # Make sure a user can only bookmark a resource once
-    __table_args__ = (db.UniqueConstraint('user_id', 'resource_id', name='bookmark_user_resource_uc'),)
+    # Make sure a user can only bookmark a resource once. The constraint's index also
+    # serves lookups by user_id, so only resource_id needs its own.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'resource_id', name='bookmark_user_resource_uc'),
+        db.Index('ix_bookmark_resource_id', 'resource_id'),
+    )
     
     def __repr__(self):
         return f"Bookmark(user_id={self.user_id}, resource_id={self.resource_id})"
 
+class ResourceText(db.Model):
+    """Text extracted from a resource for the chatbot, filled in by a background ingestion job."""
+    id = db.Column(db.Integer, primary_key=True)
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False, unique=True)
+    fingerprint = db.Column(db.String(64), nullable=False)  # chatbot.content_fingerprint() of the source
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'ready', 'failed'
+    text = db.Column(db.Text, nullable=True)  # Kept while a re-extraction is pending
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # When queued or finished
+    expires_at = db.Column(db.DateTime, nullable=True)  # None means valid until the content changes
+    # HTTP validators for web links, used to revalidate instead of re-downloading
+    etag = db.Column(db.String(255), nullable=True)
+    last_modified = db.Column(db.String(64), nullable=True)
+    
+    def is_expired(self):
+        return self.expires_at is not None and datetime.utcnow() > self.expires_at
+    
+    def is_stuck(self):
+        # A pending job that never finished, e.g. because the worker process restarted
+        return self.status == 'pending' and datetime.utcnow() - self.updated_at > INGESTION_STALE_AFTER
+    
+    def __repr__(self):
+        return f"ResourceText(resource_id={self.resource_id}, status='{self.status}')"
+
+class YouTubeTranscript(db.Model):
+    """Cached transcript of a YouTube video, or the reason it has none."""
+    __tablename__ = 'youtube_transcript'
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.String(64), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False)  # 'ready' or 'unavailable' (e.g. subtitles disabled)
+    transcript = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=True)  # Only set for 'unavailable', transcripts are kept
+    
+    def is_expired(self):
+        return self.expires_at is not None and datetime.utcnow() > self.expires_at
+    
+    def __repr__(self):
+        return f"YouTubeTranscript('{self.video_id}', '{self.status}')"
+
+class ChatConversation(db.Model):
+    """A user's chatbot conversation about a resource."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False)
+    # Only set when chatting about a PDF page range, otherwise the resource's ResourceText is used
+    page_start = db.Column(db.Integer, nullable=True)
+    page_end = db.Column(db.Integer, nullable=True)
+    page_text = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    messages = db.relationship('ChatMessage', backref='conversation', lazy=True, cascade="all, delete-orphan",
+                               order_by="ChatMessage.id")
+    resource = db.relationship('Resource', backref=db.backref('conversations', cascade="all, delete-orphan"))
+    
+    __table_args__ = (db.Index('ix_chat_conversation_user_id_resource_id', 'user_id', 'resource_id'),)
+    
+    @property
+    def resource_text(self):
+        if self.page_text is not None:
+            return self.page_text
+        record = self.resource.extracted_text
+        return record.text if record else None
+    
+    def history(self):
+        """Return the conversation in the format Gemini's chat API expects."""
+        return [{'role': message.role, 'parts': [message.content]} for message in self.messages]
+    
+    def __repr__(self):
+        return f"ChatConversation(user_id={self.user_id}, resource_id={self.resource_id})"
+
+class ChatMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('chat_conversation.id'), nullable=False)
+    role = db.Column(db.String(10), nullable=False)  # 'user' or 'model'
+    content = db.Column(db.Text, nullable=False)
+    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_chat_message_conversation_id', 'conversation_id'),)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -315,40 +503,327 @@ def send_comment_notification(comment):
     
     send_email(subject, [resource.author.email], text_body, html_body)
 
+# Chatbot helpers
+def get_resource_source(resource):
+    """Return what the chatbot should read for a resource: a file path for PDFs, the URL otherwise."""
+    content = resource.content
+    if resource.resource_type == 'pdf':
+        # PDF content is normally a path like "/static/uploads/filename.pdf"
+        if os.path.isabs(content) and os.path.exists(content):
+            return content
+        return os.path.join(app.root_path, content.lstrip('/'))
+    return content
+
+# How long a failed extraction is remembered before it is retried
+INGESTION_RETRY_AFTER = timedelta(minutes=10)
+# How long a job may stay pending before it is assumed lost and queued again
+INGESTION_STALE_AFTER = timedelta(minutes=5)
+
+# Jobs running in this process, so concurrent requests share one extraction per resource
+_ingestion_jobs = {}  # resource id -> (fingerprint, Future)
+_ingestion_jobs_lock = Lock()
+
+def claim_ingestion(resource_id, fingerprint):
+    """Mark a resource's text as pending, unless another job already owns it.
+    
+    The conditional update makes the claim atomic across worker processes sharing
+    the database. Returns True if the caller should run the extraction.
+    """
+    now = datetime.utcnow()
+    table = ResourceText.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.resource_id == resource_id)
+        .where(db.or_(table.c.status != 'pending',
+                      table.c.updated_at < now - INGESTION_STALE_AFTER,
+                      table.c.fingerprint != fingerprint))
+        .values(status='pending', fingerprint=fingerprint, error=None, updated_at=now, expires_at=None)
+    )
+    if result.rowcount:
+        db.session.commit()
+        return True
+    
+    # Either a fresh pending job exists, or there is no row yet
+    if ResourceText.query.filter_by(resource_id=resource_id).first() is not None:
+        db.session.rollback()
+        return False
+    
+    db.session.add(ResourceText(resource_id=resource_id, fingerprint=fingerprint, status='pending', updated_at=now))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process inserted the row first and owns the job
+        db.session.rollback()
+        return False
+    return True
+
+def enqueue_ingestion(resource):
+    """Queue a background job to extract a resource's text, unless one is already running.
+    
+    Returns the job's Future when it runs in this process, otherwise None.
+    """
+    resource_id = resource.id
+    source = get_resource_source(resource)
+    fingerprint = chatbot.content_fingerprint(resource.resource_type, source)
+    
+    with _ingestion_jobs_lock:
+        job = _ingestion_jobs.get(resource_id)
+        if job and job[0] == fingerprint and not job[1].done():
+            return job[1]
+    
+    # The claim is made outside the lock so that other resources are not held up by this
+    # database write. Of two threads racing here, the conditional update lets only one win.
+    if not claim_ingestion(resource_id, fingerprint):
+        app.logger.info(f"Text ingestion for resource {resource_id} is already running")
+        return None
+    
+    with _ingestion_jobs_lock:
+        future = ingestion_executor.submit(ingest_resource_text, app, resource_id)
+        _ingestion_jobs[resource_id] = (fingerprint, future)
+    
+    def forget(finished):
+        with _ingestion_jobs_lock:
+            if _ingestion_jobs.get(resource_id, (None, None))[1] is finished:
+                del _ingestion_jobs[resource_id]
+    
+    future.add_done_callback(forget)
+    app.logger.info(f"Queued text ingestion for resource {resource_id}")
+    return future
+
+# Extractions of a PDF page range, keyed by (resource id, fingerprint, start, end). They run
+# on the ingestion pool too, and finished ones are kept for the client's next poll and for
+# anyone else asking for the same pages. Guarded by _ingestion_jobs_lock.
+PAGE_RANGE_JOBS_KEPT = 64
+_page_range_jobs = OrderedDict()
+
+def get_page_range_text(resource, page_range):
+    """Return (status, text_or_error) for a page range of a PDF resource, extracting it in the background."""
+    source = get_resource_source(resource)
+    key = (resource.id, chatbot.content_fingerprint('pdf', source)) + tuple(page_range)
+    with _ingestion_jobs_lock:
+        job = _page_range_jobs.get(key)
+        if job is None:
+            app.logger.info(f"Queued extraction of pages {page_range[0]}-{page_range[1]} of resource {resource.id}")
+            job = ingestion_executor.submit(chatbot.get_resource_text, 'pdf', source,
+                                            max_chars=chatbot.MAX_RESOURCE_CHARS, page_range=page_range)
+            _page_range_jobs[key] = job
+            while len(_page_range_jobs) > PAGE_RANGE_JOBS_KEPT:
+                _page_range_jobs.popitem(last=False)
+        else:
+            _page_range_jobs.move_to_end(key)
+    
+    if not job.done():
+        return 'pending', None
+    try:
+        text = job.result()
+    except Exception as e:
+        text = f"Error: Could not read pages {page_range[0]}-{page_range[1]}: {str(e)}"
+    if text.startswith("Error"):
+        # Report the failure once, the next request tries again
+        with _ingestion_jobs_lock:
+            if _page_range_jobs.get(key) is job:
+                del _page_range_jobs[key]
+        return 'failed', text
+    return 'ready', text
+
+def ingest_resource_text(app, resource_id):
+    """Extract and store the text for a resource. Runs on the ingestion worker pool."""
+    with app.app_context():
+        try:
+            resource = Resource.query.get(resource_id)
+            if resource is None:
+                return
+            
+            source = get_resource_source(resource)
+            fingerprint = chatbot.content_fingerprint(resource.resource_type, source)
+            record = resource.extracted_text
+            
+            validators = {}
+            if resource.resource_type == 'link':
+                # Send the stored validators only if the stored text belongs to this URL
+                previous = record if record and record.text and record.fingerprint == fingerprint else None
+                resource_text, validators = chatbot.fetch_webpage_text(
+                    source,
+                    etag=previous.etag if previous else None,
+                    last_modified=previous.last_modified if previous else None)
+                if resource_text is None and previous is None:
+                    # Not modified, but there is no stored text to keep, so fetch the page in full
+                    resource_text, validators = chatbot.fetch_webpage_text(source)
+                    if resource_text is None:
+                        resource_text = "Error: The server answered 304 Not Modified to an unconditional request."
+                elif resource_text is None:
+                    # Not modified, keep the stored text
+                    resource_text = previous.text
+                    app.logger.info(f"Web page for resource {resource_id} is unchanged")
+                resource_text = resource_text[:chatbot.MAX_RESOURCE_CHARS]
+            elif resource.resource_type == 'youtube' and 'list=' not in source and chatbot.extract_youtube_id(source):
+                resource_text = get_youtube_transcript(chatbot.extract_youtube_id(source))
+                resource_text = resource_text[:chatbot.MAX_RESOURCE_CHARS]
+            else:
+                resource_text = chatbot.get_resource_text(resource.resource_type, source,
+                                                          max_chars=chatbot.MAX_RESOURCE_CHARS)
+            
+            # A refresh of text that is already stored for this exact content
+            refresh = record is not None and record.text is not None and record.fingerprint == fingerprint
+            if record is None:
+                record = ResourceText(resource_id=resource.id)
+                db.session.add(record)
+            record.fingerprint = fingerprint
+            record.updated_at = datetime.utcnow()
+            
+            if resource_text.startswith("Error"):
+                record.status = 'failed'
+                record.error = resource_text
+                record.expires_at = datetime.utcnow() + INGESTION_RETRY_AFTER
+                if refresh:
+                    # Keep serving the last good text and its validators until a retry succeeds
+                    app.logger.error(f"Refreshing the text of resource {resource_id} failed, "
+                                     f"keeping the previous text: {resource_text}")
+                else:
+                    # Whatever is stored was extracted from other content
+                    record.text = None
+                    record.etag = None
+                    record.last_modified = None
+                    app.logger.error(f"Text ingestion failed for resource {resource_id}: {resource_text}")
+            else:
+                ttl = chatbot.TEXT_CACHE_TTLS.get(resource.resource_type)
+                record.etag = validators.get('etag')
+                record.last_modified = validators.get('last_modified')
+                record.status = 'ready'
+                record.text = resource_text
+                record.error = None
+                record.expires_at = datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
+                app.logger.info(f"Ingested {len(resource_text)} characters for resource {resource_id}")
+            
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error ingesting resource {resource_id}: {str(e)}")
+
+# Videos without a usable transcript are not asked for again until this has passed
+TRANSCRIPT_UNAVAILABLE_RETRY_AFTER = timedelta(days=7)
+
+def store_youtube_transcript(video_id, status, text):
+    """Cache the result of chatbot.fetch_youtube_transcript. Transient errors are not cached."""
+    if status not in ('ready', 'unavailable'):
+        return
+    
+    record = YouTubeTranscript.query.filter_by(video_id=video_id).first()
+    if record is None:
+        record = YouTubeTranscript(video_id=video_id)
+        db.session.add(record)
+    record.status = status
+    record.transcript = text if status == 'ready' else None
+    record.error = text if status == 'unavailable' else None
+    record.fetched_at = datetime.utcnow()
+    record.expires_at = datetime.utcnow() + TRANSCRIPT_UNAVAILABLE_RETRY_AFTER if status == 'unavailable' else None
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored the same video first
+        db.session.rollback()
+
+def get_youtube_transcript(video_id):
+    """Return a video's transcript or error message, fetching it only if it is not cached."""
+    record = YouTubeTranscript.query.filter_by(video_id=video_id).first()
+    if record and not record.is_expired():
+        return record.transcript if record.status == 'ready' else record.error
+    
+    status, text = chatbot.fetch_youtube_transcript(video_id)
+    store_youtube_transcript(video_id, status, text)
+    return text
+
+def read_ingested_text(resource):
+    """Return (status, text_or_error) from the stored record, or (None, None) if it is missing or stale."""
+    record = resource.extracted_text
+    fingerprint = chatbot.content_fingerprint(resource.resource_type, get_resource_source(resource))
+    
+    if record and record.fingerprint == fingerprint:
+        if record.status == 'pending' and not record.is_stuck():
+            return 'pending', None
+        if record.status == 'ready' and not record.is_expired():
+            return 'ready', record.text
+        if record.status == 'failed' and not record.is_expired():
+            # A failed refresh still has the last good text
+            if record.text is not None:
+                return 'ready', record.text
+            return 'failed', record.error
+    return None, None
+
+def get_ingested_text(resource, wait=0):
+    """Return (status, text_or_error) for a resource, queueing ingestion if the text is missing or stale.
+    
+    Request handlers return 'pending' straight away and let the client poll. Other
+    callers may pass `wait` to block up to that many seconds for a job running in
+    this process.
+    """
+    status, text = read_ingested_text(resource)
+    if status in ('ready', 'failed'):
+        return status, text
+    
+    if status is None:
+        job = enqueue_ingestion(resource)
+    else:
+        with _ingestion_jobs_lock:
+            job = _ingestion_jobs.get(resource.id, (None, None))[1]
+    
+    if job is None or not wait:
+        return 'pending', None
+    
+    try:
+        job.result(timeout=wait)
+    except FutureTimeoutError:
+        return 'pending', None
+    
+    # The job committed in its own session, reload what it stored
+    db.session.expire_all()
+    status, text = read_ingested_text(resource)
+    return status or 'pending', text
+
 # Routes
 @app.route('/')
 @app.route('/home')
 def home():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 9  # Number of resources per page
     
     # Get filter parameters
     category_id = request.args.get('category', type=int)
     resource_type = request.args.get('type')
+    sort = request.args.get('sort', 'newest')
+    min_rating = request.args.get('min_rating', type=int)
     
     # Base query
-    query = Resource.query
+    query = listing_query()
     
     # Apply filters if provided
+    categories = cached_categories()
     if category_id:
-        category = Category.query.get_or_404(category_id)
-        query = category.resources
+        if not any(category.id == category_id for category in categories):
+            abort(404)
+        query = query.join(Resource.categories).filter(Category.id == category_id)
     
     if resource_type:
         query = query.filter_by(resource_type=resource_type)
     
+    if min_rating:
+        query = query.filter(Resource.avg_rating >= min_rating)
+    
     # Apply pagination
-    resources = query.order_by(Resource.date_posted.desc()).paginate(page=page, per_page=per_page)
+    resources = keyset_paginate(query, Resource, RESOURCE_SORTS.get(sort, RESOURCE_SORTS['newest']),
+                                cursor, per_page)
     
-    categories = Category.query.all()
     resource_types = ['link', 'pdf', 'youtube']
     
     return render_template('home.html', 
                           resources=resources, 
+                          facets=resource_facets(),
                           categories=categories,
                           resource_types=resource_types,
                           current_category=category_id,
-                          current_type=resource_type)
+                          current_type=resource_type,
+                          current_sort=sort,
+                          min_rating=min_rating)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -415,11 +890,12 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 6  # Number of resources per page
-    resources = Resource.query.filter_by(author=current_user).order_by(
-        Resource.date_posted.desc()).paginate(page=page, per_page=per_page)
-    return render_template('profile.html', resources=resources)
+    facets = resource_facets(current_user.id)
+    resources = keyset_paginate(Resource.query.filter_by(user_id=current_user.id), Resource,
+                                RESOURCE_SORTS['newest'], cursor, per_page, total=facets['total'])
+    return render_template('profile.html', resources=resources, facets=facets)
 
 @app.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
@@ -591,7 +1067,7 @@ def new_resource():
         if not content and resource_type != 'pdf': # PDF content is a path, can be empty if file not uploaded but then error flashed
             flash(f'URL content for {resource_type} is missing.', 'danger')
             # Get all categories for the form again before re-rendering
-            categories_for_form = Category.query.all()
+            categories_for_form = cached_categories()
             return render_template('create_resource.html', categories=categories_for_form, title=title, description=description, resource_type=resource_type, category_ids=category_ids)
 
         resource = Resource(
@@ -609,7 +1085,12 @@ def new_resource():
                 resource.categories.append(category)
         
         db.session.add(resource)
+        bump_cache_version('categories')  # Resource counts
         db.session.commit()
+        invalidate_facets(current_user.id)
+        
+        # Extract text for the chatbot ahead of the first chat
+        enqueue_ingestion(resource)
         
         # Send notification to users
         send_resource_notification(resource)
@@ -618,7 +1099,7 @@ def new_resource():
         return redirect(url_for('home'))
     
     # Get all categories for the form
-    categories = Category.query.all()
+    categories = cached_categories()
     return render_template('create_resource.html', categories=categories)
 
 @app.route('/resource/<int:resource_id>')
@@ -627,25 +1108,324 @@ def resource(resource_id):
     user_rating = None
     is_bookmarked = False
     
-    # Debug YouTube URLs
-    if resource.resource_type == 'youtube':
-        print(f"DEBUG - YouTube URL in DB: {resource.content}")
-        if 'youtu.be/' in resource.content:
-            video_id = resource.content.split('youtu.be/')[1].split('?')[0]
-            print(f"DEBUG - Extracted video ID: {video_id}")
-    
     if current_user.is_authenticated:
         user_rating = Rating.query.filter_by(user_id=current_user.id, resource_id=resource_id).first()
         is_bookmarked = Bookmark.query.filter_by(user_id=current_user.id, resource_id=resource_id).first() is not None
     
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 10  # Number of comments per page
-    comments = Comment.query.filter_by(resource_id=resource_id).order_by(
-        Comment.date_posted.desc()).paginate(page=page, per_page=per_page)
+    query = Comment.query.filter_by(resource_id=resource_id)
+    comments = keyset_paginate(query, Comment, ('date_posted', 'id'), cursor, per_page,
+                               total=query.count())
     
     return render_template('resource.html', resource=resource, user_rating=user_rating, 
                           comments=comments, is_bookmarked=is_bookmarked)
 
+def update_rating_aggregates(resource_id, sum_change, count_change):
+    """Adjust a resource's rating totals in the current transaction.
+    
+    The update is done in SQL so concurrent ratings don't overwrite each other's changes.
+    """
+    count = Resource.rating_count + count_change
+    Resource.query.filter_by(id=resource_id).update({
+        Resource.rating_sum: Resource.rating_sum + sum_change,
+        Resource.rating_count: count,
+        # SET expressions see the old row, so the average is worked out from the new totals here
+        Resource.rating_avg: db.case((count > 0, db.cast(Resource.rating_sum + sum_change, db.Float) / count),
+                                     else_=0.0),
+    }, synchronize_session=False)
+
+def reconcile_rating_aggregates():
+    """Recompute every resource's rating totals from the Rating rows. Returns how many were wrong."""
+    totals = db.session.query(
+        Rating.resource_id, db.func.count(Rating.id), db.func.coalesce(db.func.sum(Rating.rating), 0)
+    ).group_by(Rating.resource_id).all()
+    actual = {resource_id: (count, total) for resource_id, count, total in totals}
+    
+    fixed = 0
+    for resource in Resource.query.all():
+        count, total = actual.get(resource.id, (0, 0))
+        average = total / count if count else 0.0
+        if (resource.rating_count, resource.rating_sum, resource.rating_avg) != (count, total, average):
+            resource.rating_count, resource.rating_sum, resource.rating_avg = count, total, average
+            fixed += 1
+    db.session.commit()
+    return fixed
+
+# Sidebar counts of resources by type and by category, for the whole site or one user.
+# They are cached per process and dropped whenever a resource is created, edited or
+# deleted here; the expiry bounds how stale other worker processes can be.
+FACET_CACHE_SECONDS = int(os.getenv('FACET_CACHE_SECONDS', '300'))
+FACET_CACHE_MAX_ENTRIES = 1024
+_facet_cache = {}  # user id, or None for the whole site -> (expires_at, facets)
+_facet_lock = Lock()
+
+def resource_facets(user_id=None):
+    """Return {'total': n, 'types': {type: n}, 'categories': {category_id: n}} for all
+    resources, or only those shared by user_id."""
+    now = datetime.utcnow()
+    with _facet_lock:
+        entry = _facet_cache.get(user_id)
+    if entry and entry[0] > now:
+        return entry[1]
+    
+    types = db.session.query(Resource.resource_type, db.func.count()).group_by(Resource.resource_type)
+    categories = db.session.query(resource_categories.c.category_id, db.func.count()).group_by(
+        resource_categories.c.category_id)
+    if user_id is not None:
+        types = types.filter(Resource.user_id == user_id)
+        categories = categories.join(Resource, Resource.id == resource_categories.c.resource_id).filter(
+            Resource.user_id == user_id)
+    type_counts = dict(types.all())
+    facets = {
+        'total': sum(type_counts.values()),
+        'types': type_counts,
+        'categories': dict(categories.all()),
+    }
+    
+    with _facet_lock:
+        if len(_facet_cache) >= FACET_CACHE_MAX_ENTRIES:
+            _facet_cache.clear()
+        _facet_cache[user_id] = (now + timedelta(seconds=FACET_CACHE_SECONDS), facets)
+    return facets
+
+def invalidate_facets(user_id):
+    """Drop the cached counts a change to one of user_id's resources affects."""
+    with _facet_lock:
+        _facet_cache.pop(None, None)
+        _facet_cache.pop(user_id, None)
+
+# Categories change rarely but are listed on most pages, so each process keeps them in
+# memory. Every change bumps the 'categories' CacheVersion in the same transaction, and
+# readers reload when the stamp in the database differs from the one they loaded.
+CategoryInfo = namedtuple('CategoryInfo', 'id name description resource_count')
+_category_cache = {'version': None, 'categories': []}
+_category_lock = Lock()
+
+def get_cache_version(name):
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+def bump_cache_version(name):
+    """Mark cached data as changed. Call before committing the change itself."""
+    updated = CacheVersion.query.filter_by(name=name).update(
+        {CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.session.add(CacheVersion(name=name, version=1))
+
+def cached_categories():
+    """All categories as CategoryInfo tuples in id order, with their resource counts."""
+    version = get_cache_version('categories')
+    with _category_lock:
+        if _category_cache['version'] == version:
+            return _category_cache['categories']
+    
+    rows = db.session.query(
+        Category.id, Category.name, Category.description, db.func.count(resource_categories.c.resource_id)
+    ).outerjoin(resource_categories).group_by(Category.id).order_by(Category.id).all()
+    categories = [CategoryInfo(*row) for row in rows]
+    with _category_lock:
+        _category_cache.update(version=version, categories=categories)
+    return categories
+
+def listing_query():
+    """Resource query for listing pages, loading each card's author in the same statement."""
+    return Resource.query.options(joinedload(Resource.author))
+
+# Orderings offered on listing pages, as Resource attributes sorted in descending order.
+# Each ends with the id so that every resource has a distinct position for keyset pagination.
+RESOURCE_SORTS = {
+    'newest': ('date_posted', 'id'),
+    'top_rated': ('avg_rating', 'rating_count', 'date_posted', 'id'),
+    'most_rated': ('rating_count', 'date_posted', 'id'),
+}
+
+# Keyset pagination. Instead of skipping rows with OFFSET, a page is fetched with
+# WHERE (sort key) < (key of the last row shown), so deep pages cost the same as the
+# first one. The key travels in an opaque, URL-safe cursor.
+class KeysetPage:
+    """One page of results with cursors for the pages before and after it."""
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total  # Only set when the caller counted the results separately
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    raise TypeError(f"Can't put {type(value).__name__} in a cursor")
+
+def _cursor_object(obj):
+    return datetime.fromisoformat(obj['dt']) if set(obj) == {'dt'} else obj
+
+def encode_cursor(direction, values):
+    """Pack a direction ('next' or 'prev') and a row's sort key into a cursor string."""
+    payload = json.dumps([direction, values], default=_cursor_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Unpack a cursor into (direction, values), or None if it is malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(payload, object_hook=_cursor_object)
+    except (ValueError, TypeError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None
+    return direction, values
+
+def keyset_columns(model, keys, columns=None):
+    """The SQL expressions to sort on for keys: model attributes, unless columns maps the key to another one."""
+    return [(columns or {}).get(key, getattr(model, key)) for key in keys]
+
+def cursor_fits(values, columns):
+    """Whether cursor values hold one value of the right Python type for each sort column.
+    
+    Cursors come back from the client, so a tampered one must give the first page
+    rather than a database error.
+    """
+    if len(values) != len(columns):
+        return False
+    for value, column in zip(values, columns):
+        try:
+            expected = column.type.python_type
+        except NotImplementedError:
+            return False
+        if isinstance(value, bool):
+            return False
+        if expected is float:
+            if not isinstance(value, (int, float)) or not math.isfinite(value):
+                return False
+        elif expected is int:
+            # SQLite integers are 64-bit
+            if not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+                return False
+        elif not isinstance(value, expected):
+            return False
+    return True
+
+def keyset_query(query, model, keys, decoded=None, columns=None):
+    """Order query by the model attributes in keys, starting after a decoded cursor if given.
+    
+    columns maps a key to the SQL expression to sort on when it is not a model column.
+    The cursor values must have been checked with cursor_fits.
+    """
+    columns = keyset_columns(model, keys, columns)
+    backwards = decoded is not None and decoded[0] == 'prev'
+    if decoded:
+        position = db.tuple_(*columns)
+        bound = db.tuple_(*[db.literal(value, column.type) for value, column in zip(decoded[1], columns)])
+        query = query.filter(position > bound if backwards else position < bound)
+    # Going back, the rows just before the cursor are read in ascending order and flipped
+    order = [column.asc() if backwards else column.desc() for column in columns]
+    return query.order_by(None).order_by(*order)
+
+def keyset_paginate(query, model, keys, cursor=None, per_page=10, total=None, columns=None):
+    """Fetch the page of query that a cursor points to, ordered by the model attributes in keys.
+    
+    Rows are sorted in descending order of all keys, and the last key must be unique.
+    A missing or malformed cursor gives the first page. columns is passed on to keyset_query.
+    """
+    decoded = decode_cursor(cursor) if cursor else None
+    if decoded and not cursor_fits(decoded[1], keyset_columns(model, keys, columns)):
+        decoded = None
+    backwards = decoded is not None and decoded[0] == 'prev'
+    rows = keyset_query(query, model, keys, decoded, columns).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    
+    def key_of(row):
+        return [getattr(row, key) for key in keys]
+    
+    next_cursor = prev_cursor = None
+    if rows:
+        if more or backwards:
+            next_cursor = encode_cursor('next', key_of(rows[-1]))
+        if (more and backwards) or (decoded and not backwards):
+            prev_cursor = encode_cursor('prev', key_of(rows[0]))
+    elif decoded:
+        # Nothing left past the cursor, e.g. after deletions: link back the way we came
+        if backwards:
+            next_cursor = encode_cursor('next', decoded[1])
+        else:
+            prev_cursor = encode_cursor('prev', decoded[1])
+    return KeysetPage(rows, next_cursor, prev_cursor, total)
+
+def create_missing_indexes():
+    """Create the indexes declared on the models that an existing database lacks; returns their names."""
+    existing = inspect(db.engine).get_table_names()
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        present = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+def hot_queries():
+    """The queries behind the busiest pages, as (name, query) pairs, for checking their plans."""
+    # Any cursor will do, plans don't depend on the bound values
+    after = ('next', [datetime.utcnow(), 0])
+    newest = RESOURCE_SORTS['newest']
+    return [
+        ('home', keyset_query(listing_query(), Resource, newest)),
+        ('home, later page', keyset_query(listing_query(), Resource, newest, after)),
+        ('home by type', keyset_query(listing_query().filter_by(resource_type='pdf'), Resource, newest, after)),
+        ('home by category', keyset_query(
+            listing_query().join(Resource.categories).filter(Category.id == 1), Resource, newest, after)),
+        ('home, most rated', keyset_query(listing_query(), Resource, RESOURCE_SORTS['most_rated'])),
+        ('home, top rated', keyset_query(listing_query(), Resource, RESOURCE_SORTS['top_rated'])),
+        ('home, top rated later page', keyset_query(
+            listing_query(), Resource, RESOURCE_SORTS['top_rated'], ('next', [4.5, 2, datetime.utcnow(), 0]))),
+        ('home, minimum rating', keyset_query(
+            listing_query().filter(Resource.avg_rating >= 4), Resource, newest, after)),
+        ('profile', keyset_query(Resource.query.filter_by(user_id=1), Resource, newest, after)),
+        ('profile facets', db.session.query(Resource.resource_type, db.func.count()).filter(
+            Resource.user_id == 1).group_by(Resource.resource_type)),
+        ('bookmarks', keyset_query(
+            listing_query().join(Bookmark).filter(Bookmark.user_id == 1), Resource, newest, after)),
+        ('comments', keyset_query(Comment.query.filter_by(resource_id=1), Comment, ('date_posted', 'id'), after)),
+        ('comment total', Comment.query.filter_by(resource_id=1).with_entities(db.func.count())),
+        ('resource ratings', Rating.query.filter_by(resource_id=1)),
+        ('user rating', Rating.query.filter_by(user_id=1, resource_id=1)),
+        ('is bookmarked', Bookmark.query.filter_by(user_id=1, resource_id=1)),
+        ('verification tokens', Token.query.filter_by(user_id=1, type='verify_email')),
+        ('chat conversations', ChatConversation.query.filter_by(user_id=1, resource_id=1)),
+    ]
+
+def explain_query_plan(query):
+    """SQLite's EXPLAIN QUERY PLAN for a query, one line per step."""
+    compiled = query.statement.compile(db.engine)
+    # Positional parameters in the order the SQL uses them
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+def is_full_scan(detail):
+    # 'SCAN resource' reads the whole table, 'SCAN resource USING INDEX ...' walks an index in order
+    return detail.startswith('SCAN ') and ' USING ' not in detail
+
 @app.route('/resource/<int:resource_id>/rate', methods=['POST'])
 @login_required
 def rate_resource(resource_id):
@@ -657,28 +1437,36 @@ def rate_resource(resource_id):
         flash('Rating must be between 1 and 5 stars.', 'danger')
         return redirect(url_for('resource', resource_id=resource_id))
         
+    if run_write(save_rating, resource_id, current_user.id, rating_value, comment):
+        flash('Your rating has been submitted!', 'success')
+    else:
+        flash('Your rating has been updated!', 'success')
+        
+    return redirect(url_for('resource', resource_id=resource_id))
+
+def save_rating(resource_id, user_id, rating_value, comment):
+    """Create or update a user's rating of a resource. Returns True if it is a new rating."""
     # Check if user has already rated this resource
-    existing_rating = Rating.query.filter_by(user_id=current_user.id, resource_id=resource_id).first()
+    existing_rating = Rating.query.filter_by(user_id=user_id, resource_id=resource_id).first()
     
     if existing_rating:
         # Update existing rating
+        change = rating_value - existing_rating.rating
         existing_rating.rating = rating_value
         existing_rating.comment = comment
-        db.session.commit()
-        flash('Your rating has been updated!', 'success')
-    else:
-        # Create new rating
-        new_rating = Rating(
-            rating=rating_value,
-            comment=comment,
-            user_id=current_user.id,
-            resource_id=resource_id
-        )
-        db.session.add(new_rating)
-        db.session.commit()
-        flash('Your rating has been submitted!', 'success')
-        
-    return redirect(url_for('resource', resource_id=resource_id))
+        update_rating_aggregates(resource_id, change, 0)
+        return False
+    
+    # Create new rating
+    new_rating = Rating(
+        rating=rating_value,
+        comment=comment,
+        user_id=user_id,
+        resource_id=resource_id
+    )
+    db.session.add(new_rating)
+    update_rating_aggregates(resource_id, rating_value, 1)
+    return True
 
 @app.route('/resource/<int:resource_id>/comment', methods=['POST'])
 @login_required
@@ -690,14 +1478,8 @@ def add_comment(resource_id):
         flash('Comment cannot be empty.', 'danger')
         return redirect(url_for('resource', resource_id=resource_id))
     
-    comment = Comment(
-        content=content,
-        user_id=current_user.id,
-        resource_id=resource_id
-    )
-    
-    db.session.add(comment)
-    db.session.commit()
+    comment_id = run_write(save_comment, resource_id, current_user.id, content)
+    comment = Comment.query.get(comment_id)
     
     # Send notification to resource author
     send_comment_notification(comment)
@@ -706,6 +1488,19 @@ def add_comment(resource_id):
     
     return redirect(url_for('resource', resource_id=resource_id))
 
+def save_comment(resource_id, user_id, content):
+    comment = Comment(
+        content=content,
+        user_id=user_id,
+        resource_id=resource_id
+    )
+    db.session.add(comment)
+    db.session.flush()  # Assigns the id
+    return comment.id
+
+def delete_comment_by_id(comment_id):
+    Comment.query.filter_by(id=comment_id).delete()
+
 @app.route('/comment/<int:comment_id>/delete', methods=['POST'])
 @login_required
 def delete_comment(comment_id):
@@ -716,8 +1511,7 @@ def delete_comment(comment_id):
     if comment.author != current_user and comment.resource.author != current_user:
         abort(403)
     
-    db.session.delete(comment)
-    db.session.commit()
+    run_write(delete_comment_by_id, comment_id)
     flash('Comment has been deleted.', 'success')
     
     return redirect(url_for('resource', resource_id=resource_id))
@@ -725,35 +1519,41 @@ def delete_comment(comment_id):
 @app.route('/resource/<int:resource_id>/bookmark', methods=['POST'])
 @login_required
 def toggle_bookmark(resource_id):
-    resource = Resource.query.get_or_404(resource_id)
-    bookmark = Bookmark.query.filter_by(user_id=current_user.id, resource_id=resource_id).first()
+    Resource.query.get_or_404(resource_id)
+    
+    if run_write(toggle_bookmark_row, current_user.id, resource_id):
+        flash('Resource added to bookmarks!', 'success')
+    else:
+        flash('Resource removed from bookmarks.', 'success')
+    
+    return redirect(url_for('resource', resource_id=resource_id))
+
+def toggle_bookmark_row(user_id, resource_id):
+    """Add the bookmark if the user doesn't have it, otherwise remove it. Returns True if added."""
+    bookmark = Bookmark.query.filter_by(user_id=user_id, resource_id=resource_id).first()
     
     if bookmark:
         # Remove bookmark
         db.session.delete(bookmark)
-        db.session.commit()
-        flash('Resource removed from bookmarks.', 'success')
-    else:
-        # Add bookmark
-        new_bookmark = Bookmark(
-            user_id=current_user.id,
-            resource_id=resource_id
-        )
-        db.session.add(new_bookmark)
-        db.session.commit()
-        flash('Resource added to bookmarks!', 'success')
+        return False
     
-    return redirect(url_for('resource', resource_id=resource_id))
+    # Add bookmark
+    new_bookmark = Bookmark(
+        user_id=user_id,
+        resource_id=resource_id
+    )
+    db.session.add(new_bookmark)
+    return True
 
 @app.route('/bookmarks')
 @login_required
 def bookmarks():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 9  # Number of resources per page
     
-    bookmarked_resources = Resource.query.join(Bookmark).filter(
+    bookmarked_resources = keyset_paginate(listing_query().join(Bookmark).filter(
         Bookmark.user_id == current_user.id
-    ).order_by(Resource.date_posted.desc()).paginate(page=page, per_page=per_page)
+    ), Resource, RESOURCE_SORTS['newest'], cursor, per_page)
     
     return render_template('bookmarks.html', resources=bookmarked_resources)
 
@@ -770,21 +1570,155 @@ def delete_resource(resource_id):
             os.remove(os.path.join(app.root_path, resource.content[1:]))
             
     db.session.delete(resource)
+    bump_cache_version('categories')  # Resource counts
     db.session.commit()
+    invalidate_facets(current_user.id)
     flash('Your resource has been deleted!', 'success')
     return redirect(url_for('home'))
 
+# Full-text search. resource_fts is an SQLite FTS5 table keyed by resource id that holds each
+# resource's title, description and the text extracted for the chatbot. Triggers keep it in
+# sync with the resource and resource_text tables, so writes need no extra code.
+SEARCH_RESULTS_PER_PAGE = 12
+SEARCH_MAX_TERMS = 16
+SEARCH_SNIPPET_TOKENS = 24
+# Snippet markers, control characters that can't come from HTML-escaped text
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+SEARCH_INDEX_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS resource_fts USING fts5(
+        title, description, body, tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS resource_fts_insert AFTER INSERT ON resource BEGIN
+        INSERT INTO resource_fts(rowid, title, description, body)
+        VALUES (new.id, new.title, new.description, (SELECT text FROM resource_text WHERE resource_id = new.id));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resource_fts_update AFTER UPDATE OF title, description ON resource BEGIN
+        UPDATE resource_fts SET title = new.title, description = new.description WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resource_fts_delete AFTER DELETE ON resource BEGIN
+        DELETE FROM resource_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resource_text_fts_insert AFTER INSERT ON resource_text BEGIN
+        UPDATE resource_fts SET body = new.text WHERE rowid = new.resource_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resource_text_fts_update AFTER UPDATE OF text ON resource_text BEGIN
+        UPDATE resource_fts SET body = new.text WHERE rowid = new.resource_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resource_text_fts_delete AFTER DELETE ON resource_text BEGIN
+        UPDATE resource_fts SET body = NULL WHERE rowid = old.resource_id;
+    END""",
+]
+
+_search_index_ready = False
+
+def create_search_index(rebuild=False):
+    """Create the search table and its triggers and index any resources missing from it.
+    
+    With rebuild, the index is emptied and filled again from scratch. Returns False if the
+    database is not SQLite or SQLite was built without FTS5.
+    """
+    global _search_index_ready
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with db.engine.begin() as conn:
+            for statement in SEARCH_INDEX_SCHEMA:
+                conn.execute(db.text(statement))
+            if rebuild:
+                conn.execute(db.text("DELETE FROM resource_fts"))
+            conn.execute(db.text(
+                "INSERT INTO resource_fts(rowid, title, description, body) "
+                "SELECT resource.id, resource.title, resource.description, resource_text.text FROM resource "
+                "LEFT JOIN resource_text ON resource_text.resource_id = resource.id "
+                "WHERE resource.id NOT IN (SELECT rowid FROM resource_fts)"))
+            if rebuild:
+                conn.execute(db.text("INSERT INTO resource_fts(resource_fts) VALUES ('optimize')"))
+    except OperationalError as e:
+        app.logger.warning(f"Full-text search is unavailable, falling back to LIKE: {e}")
+        return False
+    _search_index_ready = True
+    return True
+
+def search_index_available():
+    """Whether the full-text search table exists. Checked until it is found, then remembered."""
+    global _search_index_ready
+    if not _search_index_ready and db.engine.dialect.name == 'sqlite':
+        _search_index_ready = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'resource_fts'")).first() is not None
+    return _search_index_ready
+
+def build_search_match(text):
+    """Turn what the user typed into an FTS5 query matching every word, the last one as a prefix.
+    
+    Words are quoted so FTS5 operators and punctuation in the input are taken literally.
+    Returns None if the input has no words.
+    """
+    terms = re.findall(r'\w+', text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def search_hits(match):
+    """Subquery of (resource_id, rank) for an FTS5 query, rank being BM25 where lower is better."""
+    # Title matches count most, then the description, then the extracted text
+    return db.text(
+        "SELECT rowid AS resource_id, bm25(resource_fts, 10.0, 5.0, 1.0) AS rank "
+        "FROM resource_fts WHERE resource_fts MATCH :match"
+    ).bindparams(match=match).columns(resource_id=db.Integer, rank=db.Float).subquery('search_hits')
+
+def search_snippets(match, resource_ids):
+    """Highlighted snippets for each resource, keyed by id.
+    
+    The title is shown on the card anyway, so the snippet comes from the description or,
+    failing that, the extracted text. Resources matched by the title alone get none.
+    """
+    if not resource_ids:
+        return {}
+    rows = db.session.execute(db.text(
+        "SELECT rowid, snippet(resource_fts, 1, :start, :end, '…', :tokens), "
+        "snippet(resource_fts, 2, :start, :end, '…', :tokens) FROM resource_fts "
+        "WHERE resource_fts MATCH :match AND rowid IN :ids"
+    ).bindparams(db.bindparam('ids', expanding=True)), {
+        'match': match, 'ids': list(resource_ids), 'tokens': SEARCH_SNIPPET_TOKENS,
+        'start': SNIPPET_START, 'end': SNIPPET_END,
+    })
+    snippets = {}
+    for resource_id, description, body in rows:
+        for snippet in (description, body):
+            if snippet and SNIPPET_START in snippet:
+                snippets[resource_id] = highlight_snippet(snippet)
+                break
+    return snippets
+
+def highlight_snippet(snippet):
+    """Escape a snippet and turn its match markers into <mark> tags."""
+    html = str(escape(snippet))
+    return Markup(html.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
 @app.route('/search', methods=['GET'])
 def search():
-    query = request.args.get('query', '')
+    query = request.args.get('query', '').strip()
     category_id = request.args.get('category_id')
     resource_type = request.args.get('resource_type')
+    sort = request.args.get('sort', 'relevance' if query else 'newest')
+    min_rating = request.args.get('min_rating', type=int)
+    cursor = request.args.get('cursor')
     
     # Base query
-    resources_query = Resource.query
+    resources_query = listing_query()
+    match = None
+    relevance = None
     
     # Apply filters
-    if query:
+    if query and search_index_available():
+        match = build_search_match(query)
+        if match:
+            hits = search_hits(match)
+            resources_query = resources_query.join(hits, hits.c.resource_id == Resource.id)
+            relevance = hits.c.rank
+        else:
+            resources_query = resources_query.filter(db.false())
+    elif query:
         resources_query = resources_query.filter(
             (Resource.title.contains(query)) | 
             (Resource.description.contains(query))
@@ -800,25 +1734,49 @@ def search():
     if resource_type:
         resources_query = resources_query.filter(Resource.resource_type == resource_type)
     
-    # Get results
-    resources = resources_query.order_by(Resource.date_posted.desc()).all()
+    if min_rating:
+        resources_query = resources_query.filter(Resource.avg_rating >= min_rating)
+    
+    # Pages are fetched by keyset like the home page. BM25 is lower for better matches,
+    # so its negation is the score to sort on in descending order.
+    score_columns = None
+    if sort == 'relevance' and relevance is not None:
+        score = -relevance
+        resources_query = resources_query.options(with_expression(Resource.search_score, score))
+        keys = ('search_score', 'id')
+        score_columns = {'search_score': score}
+    else:
+        keys = RESOURCE_SORTS.get(sort, RESOURCE_SORTS['newest'])
+    
+    # Counting means finding every match, so it is done for the first page only
+    total = None if cursor else resources_query.order_by(None).count()
+    
+    # Get one page of results, with snippets showing where each one matched
+    resources = keyset_paginate(resources_query, Resource, keys, cursor, SEARCH_RESULTS_PER_PAGE,
+                                total=total, columns=score_columns)
+    snippets = search_snippets(match, [resource.id for resource in resources.items]) if match else {}
     
     # Get all categories for filtering
-    categories = Category.query.all()
+    categories = cached_categories()
     
-    return render_template('search.html', resources=resources, query=query, 
-                          categories=categories, selected_category_id=category_id)
+    # Filters to carry over to the other pages
+    search_args = request.args.to_dict()
+    search_args.pop('cursor', None)
+    
+    return render_template('search.html', resources=resources, query=query, snippets=snippets,
+                          categories=categories, selected_category_id=category_id,
+                          current_sort=sort, search_args=search_args)
 
 @app.route('/categories')
 def categories():
-    categories = Category.query.all()
+    categories = cached_categories()
     return render_template('categories.html', categories=categories)
 
 @app.route('/category/<int:category_id>')
 def category(category_id):
     category = Category.query.get_or_404(category_id)
     # Get resources from this category, ordered by date
-    resources = Resource.query.join(Resource.categories).filter(Category.id == category_id).order_by(Resource.date_posted.desc()).all()
+    resources = listing_query().join(Resource.categories).filter(Category.id == category_id).order_by(Resource.date_posted.desc()).all()
     return render_template('category.html', category=category, resources=resources)
 
 @app.route('/categories/manage', methods=['GET', 'POST'])
@@ -839,6 +1797,7 @@ def user_manage_categories():
             if name:
                 category = Category(name=name, description=description)
                 db.session.add(category)
+                bump_cache_version('categories')
                 db.session.commit()
                 flash(f'Category "{name}" has been added!', 'success')
             
@@ -849,12 +1808,13 @@ def user_manage_categories():
                 category = Category.query.get(category_id)
                 if category:
                     db.session.delete(category)
+                    bump_cache_version('categories')
                     db.session.commit()
                     flash(f'Category "{category.name}" has been deleted!', 'success')
         
         return redirect(url_for('user_manage_categories'))
     
-    categories = Category.query.all()
+    categories = cached_categories()
     return render_template('manage_categories.html', categories=categories)
 
 # Admin routes
@@ -898,7 +1858,7 @@ def update_user_role(user_id):
 @login_required
 @role_required('moderator')
 def admin_manage_categories():
-    categories = Category.query.order_by(Category.name).all()
+    categories = sorted(cached_categories(), key=lambda category: category.name)
     return render_template('admin/categories.html', categories=categories)
 
 @app.route('/admin/categories/add', methods=['GET', 'POST'])
@@ -920,6 +1880,7 @@ def add_category():
         
         category = Category(name=name, description=description)
         db.session.add(category)
+        bump_cache_version('categories')
         db.session.commit()
         flash('Category added successfully.', 'success')
         return redirect(url_for('admin_manage_categories'))
@@ -947,6 +1908,7 @@ def edit_category(category_id):
         
         category.name = name
         category.description = description
+        bump_cache_version('categories')
         db.session.commit()
         flash('Category updated successfully.', 'success')
         return redirect(url_for('admin_manage_categories'))
@@ -959,89 +1921,171 @@ def edit_category(category_id):
 def delete_category(category_id):
     category = Category.query.get_or_404(category_id)
     
-    if category.resources.count() > 0:
+    if category.resources:
         flash('Cannot delete category that has resources. Remove all resources from this category first.', 'danger')
         return redirect(url_for('admin_manage_categories'))
     
     db.session.delete(category)
+    bump_cache_version('categories')
     db.session.commit()
     flash('Category deleted successfully.', 'success')
     return redirect(url_for('admin_manage_categories'))
 
 # Chatbot routes
-@app.route('/api/chatbot/init/<int:resource_id>', methods=['POST'])
-@login_required
-def chatbot_init(resource_id):
-    """Initialize chatbot with resource content."""
+def chatbot_unavailable_response():
+    """Return an error response if the chatbot can't take requests yet, otherwise None."""
     # Check if API key is set
-    if not os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY") == "not_set":
+    if not chatbot.USE_FAKE_GEMINI and (not os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY") == "not_set"):
         return jsonify({
             'success': False, 
             'error': 'Gemini API key is not configured. Please set GEMINI_API_KEY in your .env file.'
         })
     
+    # The model is probed in the background after startup
+    if chatbot.model_status in ('idle', 'initializing'):
+        chatbot.start_model_initialization()
+        return jsonify({
+            'success': False,
+            'pending': True,
+            'error': 'The AI model is still starting up. Please try again in a few seconds.'
+        })
+    
     # Check if model works
-    if not chatbot.model_works or chatbot.model is None:
+    if not chatbot.model_ready():
         return jsonify({
             'success': False,
             'error': 'The Gemini AI model is not working. Please check your API key and internet connection.'
         })
+    
+    return None
+
+def sse_event(event, data):
+    """Format a Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def get_conversation(conversation_id):
+    """Return the current user's conversation with the given id, or None."""
+    try:
+        conversation_id = int(conversation_id)
+    except (TypeError, ValueError):
+        return None
+    return ChatConversation.query.filter_by(id=conversation_id, user_id=current_user.id).first()
+
+def append_chat_messages(conversation, new_turns):
+    """Store new chat turns returned by Gemini on a conversation."""
+    for turn in new_turns:
+        entry = chatbot.history_entry_to_dict(turn)
+        db.session.add(ChatMessage(conversation_id=conversation.id, role=entry['role'],
+                                   content="".join(entry['parts'])))
+    db.session.commit()
+
+@app.route('/admin/chatbot/stats')
+@login_required
+@role_required('admin')
+def chatbot_stats():
+    """Return Gemini model, call pool, response cache and prompt size metrics for this worker process."""
+    stats = chatbot.get_gemini_stats()
+    stats['model_status'] = chatbot.model_status
+    stats['model_name'] = chatbot.model_name
+    stats['response_cache'] = chatbot.response_cache.stats()
+    stats['average_prompt_chars_by_turn'] = chatbot.get_prompt_size_stats()
+    stats['routing'] = chatbot.model_router.stats()
+    return jsonify(stats)
+
+@app.route('/admin/chatbot')
+@login_required
+@role_required('admin')
+def admin_chatbot():
+    """Show per-model health and recent routing decisions for this worker process."""
+    return render_template('admin/chatbot.html', routing=chatbot.model_router.stats(),
+                           pool=chatbot.get_gemini_stats(), model_status=chatbot.model_status)
+
+@app.route('/api/chatbot/init/<int:resource_id>', methods=['POST'])
+@login_required
+def chatbot_init(resource_id):
+    """Initialize chatbot with resource content."""
+    unavailable = chatbot_unavailable_response()
+    if unavailable:
+        return unavailable
         
     try:
         resource = Resource.query.get_or_404(resource_id)
         app.logger.info(f"Initializing chatbot for resource ID {resource_id}, type: {resource.resource_type}")
         
         # Get the resource content
-        content = resource.content
+        content = get_resource_source(resource)
         if resource.resource_type == 'pdf':
-            # For PDF files, content should be a path like "/static/uploads/filename.pdf"
-            # We need to convert it to an absolute path
-            if content.startswith('/'):
-                file_path = os.path.join(app.root_path, content[1:])  # Remove leading slash
-            else:
-                file_path = os.path.join(app.root_path, content)
-            
-            app.logger.info(f"Processing PDF file: {file_path}")
+            app.logger.info(f"Processing PDF file: {content}")
                 
-            if not os.path.exists(file_path):
-                error_msg = f'PDF file not found at {file_path}. Please make sure the file exists.'
+            if not os.path.exists(content):
+                error_msg = f'PDF file not found at {content}. Please make sure the file exists.'
                 app.logger.error(error_msg)
                 return jsonify({
                     'success': False,
                     'error': error_msg
                 })
-            content = file_path
         
-        # Get resource text based on type
-        app.logger.info(f"Extracting text from {resource.resource_type}: {content[:100]}...")
-        resource_text = chatbot.get_resource_text(resource.resource_type, content)
+        # Optional page range so users can chat about specific chapters of a PDF
+        data = request.get_json(silent=True) or {}
+        start_page = data.get('start_page')
+        end_page = data.get('end_page')
+        
+        page_range = None
+        if resource.resource_type == 'pdf' and (start_page is not None or end_page is not None):
+            try:
+                start = int(start_page if start_page is not None else end_page)
+                end = int(end_page if end_page is not None else start)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'Page numbers must be whole numbers.'}), 400
+            if not 1 <= start <= end:
+                return jsonify({
+                    'success': False,
+                    'error': 'Pages must be numbered from 1, with the first page no later than the last.'
+                }), 400
+            page_range = (start, end)
+            
+            # The pages are extracted on the ingestion pool, the client polls until they are ready
+            status, resource_text = get_page_range_text(resource, page_range)
+        else:
+            # Text is extracted ahead of time by the ingestion workers
+            status, resource_text = get_ingested_text(resource)
+        
+        if status == 'pending':
+            return jsonify({
+                'success': False,
+                'pending': True,
+                'error': 'This resource is still being processed. Please try again in a few seconds.'
+            })
         
-        if resource_text.startswith("Error"):
+        if status == 'failed':
             app.logger.error(f"Error extracting text: {resource_text}")
             return jsonify({
                 'success': False,
                 'error': resource_text
             })
         
-        app.logger.info(f"Successfully extracted text of length {len(resource_text)}")
+        app.logger.info(f"Loaded ingested text of length {len(resource_text)}")
         
-        # Initialize session for this chat
-        if 'chatbot_sessions' not in session:
-            session['chatbot_sessions'] = {}
+        # Start a fresh conversation, replacing any earlier one about this resource
+        for old_conversation in ChatConversation.query.filter_by(user_id=current_user.id, resource_id=resource_id):
+            db.session.delete(old_conversation)
+        conversation = ChatConversation(user_id=current_user.id, resource_id=resource_id)
+        if page_range:
+            conversation.page_start, conversation.page_end = page_range
+            conversation.page_text = resource_text
+        db.session.add(conversation)
+        db.session.commit()
         
-        # Create a unique session ID for this resource
-        session_id = f"resource_{resource_id}"
-        session['chatbot_sessions'][session_id] = {
-            'resource_id': resource_id,
-            'resource_text': resource_text[:15000], # Limit text size
-            'history': []
-        }
+        # Chat state used to live in the session, drop it from older sessions
+        session.pop('chatbot_sessions', None)
+        session_id = str(conversation.id)
         
         return jsonify({
             'success': True, 
             'session_id': session_id,
             'resource_type': resource.resource_type,
-            'model': 'Gemini 2.0 Flash' if chatbot.model_works else 'Not available'
+            'page_range': [page_range[0], page_range[1]] if page_range else None,
+            'model': chatbot.model_name if chatbot.model_ready() else 'Not available'
         })
     except Exception as e:
         app.logger.error(f"Error initializing chatbot: {str(e)}")
@@ -1054,19 +2098,9 @@ def chatbot_init(resource_id):
 @login_required
 def chatbot_chat():
     """Chat with the chatbot."""
-    # Check if API key is set
-    if not os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY") == "not_set":
-        return jsonify({
-            'success': False, 
-            'error': 'Gemini API key is not configured. Please set GEMINI_API_KEY in your .env file.'
-        })
-    
-    # Check if model works
-    if not chatbot.model_works or chatbot.model is None:
-        return jsonify({
-            'success': False,
-            'error': 'The Gemini AI model is not working. Please check your API key and internet connection.'
-        })
+    unavailable = chatbot_unavailable_response()
+    if unavailable:
+        return unavailable
     
     try:
         data = request.json
@@ -1076,20 +2110,18 @@ def chatbot_chat():
         if not session_id or not prompt:
             return jsonify({'success': False, 'error': 'Invalid session ID or prompt'})
             
-        if 'chatbot_sessions' not in session:
-            return jsonify({'success': False, 'error': 'No active chatbot sessions'})
-            
-        if session_id not in session['chatbot_sessions']:
+        conversation = get_conversation(session_id)
+        if conversation is None:
             return jsonify({'success': False, 'error': 'Session expired or invalid'})
         
-        chat_session = session['chatbot_sessions'][session_id]
-        resource_text = chat_session.get('resource_text')
-        history = chat_session.get('history', [])
+        resource_text = conversation.resource_text
+        history = conversation.history()
         
         # Get response from Gemini with timeout handling
         try:
             # 45 second timeout for generation
-            response_text, updated_history = chatbot.chat_with_gemini(prompt, resource_text, history, timeout=45)
+            response_text, updated_history = chatbot.chat_with_gemini(prompt, resource_text, history, timeout=45,
+                                                                       user=current_user.id)
         except chatbot.TimeoutError:
             return jsonify({
                 'success': False, 
@@ -1097,18 +2129,21 @@ def chatbot_chat():
             })
         
         # Check if response indicates an error
-        if response_text.startswith("Error generating response:") or response_text.startswith("The AI model took too long"):
+        if (response_text.startswith("Error generating response:") or response_text.startswith("The AI model took too long")
+                or response_text == chatbot.BUSY_MESSAGE):
             app.logger.error(f"Chatbot error: {response_text}")
             return jsonify({
                 'success': False, 
                 'error': response_text
             })
         
-        # Update session history
-        chat_session['history'] = updated_history
-        session.modified = True
+        # Store only the turns added by this exchange
+        append_chat_messages(conversation, updated_history[len(history):])
+        
+        # Prompt size for this turn, which should stay flat as the conversation grows
+        prompt_size = chatbot.measure_prompt(prompt, resource_text, history)
         
-        return jsonify({'success': True, 'response': response_text})
+        return jsonify({'success': True, 'response': response_text, 'prompt_size': prompt_size})
     except Exception as e:
         app.logger.error(f"Error in chatbot_chat: {str(e)}")
         return jsonify({
@@ -1116,6 +2151,48 @@ def chatbot_chat():
             'error': f'Error processing request: {str(e)}'
         })
 
+@app.route('/api/chatbot/stream', methods=['POST'])
+@login_required
+def chatbot_stream():
+    """Chat with the chatbot, streaming the response as Server-Sent Events."""
+    unavailable = chatbot_unavailable_response()
+    if unavailable:
+        return unavailable
+    
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    prompt = data.get('prompt')
+    
+    if not session_id or not prompt:
+        return jsonify({'success': False, 'error': 'Invalid session ID or prompt'})
+        
+    conversation = get_conversation(session_id)
+    if conversation is None:
+        return jsonify({'success': False, 'error': 'Session expired or invalid'})
+    
+    resource_text = conversation.resource_text
+    history = conversation.history()
+    user_id = current_user.id
+    
+    def generate():
+        try:
+            for kind, payload in chatbot.stream_chat_with_gemini(prompt, resource_text, history, timeout=45,
+                                                                  user=user_id):
+                if kind == 'text':
+                    yield sse_event('message', {'text': payload})
+                elif kind == 'done':
+                    append_chat_messages(conversation, payload[len(history):])
+                    yield sse_event('done', {'prompt_size': chatbot.measure_prompt(prompt, resource_text, history)})
+                else:
+                    app.logger.error(f"Chatbot error: {payload}")
+                    yield sse_event('error', {'error': payload})
+        except Exception as e:
+            app.logger.error(f"Error in chatbot_stream: {str(e)}")
+            yield sse_event('error', {'error': f'Error processing request: {str(e)}'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/edit_resource/<int:resource_id>', methods=['GET', 'POST'])
 @login_required
 def edit_resource(resource_id):
@@ -1128,9 +2205,10 @@ def edit_resource(resource_id):
         return redirect(url_for('resource', resource_id=resource.id))
     
     # Get all categories
-    categories = Category.query.all()
+    categories = cached_categories()
     
     if request.method == 'POST':
+        old_content = resource.content
         resource.title = request.form['title']
         resource.description = request.form['description']
         
@@ -1180,26 +2258,145 @@ def edit_resource(resource_id):
                     resource.categories.append(category)
         
         # Save changes
+        bump_cache_version('categories')  # Resource counts
         db.session.commit()
+        invalidate_facets(current_user.id)
+        
+        # Re-extract chatbot text if the underlying content changed
+        if resource.content != old_content:
+            enqueue_ingestion(resource)
+        
         flash('Resource updated successfully!', 'success')
         return redirect(url_for('resource', resource_id=resource.id))
     
     return render_template('edit_resource.html', resource=resource, categories=categories)
 
+@app.cli.command('explain-hot-queries')
+def explain_hot_queries():
+    """Show the query plans of the hot listing queries and fail if any scans a whole table."""
+    full_scans = []
+    for name, query in hot_queries():
+        click.echo(name)
+        for detail in explain_query_plan(query):
+            click.echo(f"    {detail}")
+            if is_full_scan(detail):
+                full_scans.append(f"{name}: {detail}")
+    if full_scans:
+        raise click.ClickException("Full table scans in hot queries:\n  " + "\n  ".join(full_scans))
+    click.echo("No full table scans")
+
+@app.cli.command('reconcile-ratings')
+def reconcile_ratings():
+    """Recompute the rating totals stored on each resource from the ratings table."""
+    fixed = reconcile_rating_aggregates()
+    click.echo(f"Fixed rating totals for {fixed} resources")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Create the full-text search index if needed and refill it from the resources."""
+    if create_search_index(rebuild=True):
+        click.echo(f"Indexed {Resource.query.count()} resources for search")
+    else:
+        click.echo("Full-text search needs SQLite with FTS5, search will use LIKE matching")
+
+@app.cli.command('prefetch-transcripts')
+@click.option('--workers', default=4, show_default=True, help='Number of transcripts fetched at once.')
+@click.option('--refresh', is_flag=True, help='Fetch again even if a transcript or failure is cached.')
+def prefetch_transcripts(workers, refresh):
+    """Fetch and cache transcripts for all YouTube video resources."""
+    video_ids = set()
+    for resource in Resource.query.filter_by(resource_type='youtube').all():
+        if 'list=' in resource.content:
+            continue  # Playlists have no single transcript
+        video_id = chatbot.extract_youtube_id(resource.content)
+        if video_id:
+            video_ids.add(video_id)
+    
+    if not refresh:
+        cached = YouTubeTranscript.query.filter(YouTubeTranscript.video_id.in_(video_ids)).all()
+        video_ids -= {record.video_id for record in cached if not record.is_expired()}
+    
+    click.echo(f"Fetching {len(video_ids)} transcripts with {workers} workers")
+    counts = {'ready': 0, 'unavailable': 0, 'error': 0}
+    # Workers only do the network calls, results are stored from this thread
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcripts') as executor:
+        futures = {executor.submit(chatbot.fetch_youtube_transcript, video_id): video_id for video_id in video_ids}
+        for future in as_completed(futures):
+            status, text = future.result()
+            store_youtube_transcript(futures[future], status, text)
+            counts[status] += 1
+    
+    click.echo(f"Done: {counts['ready']} cached, {counts['unavailable']} unavailable, {counts['error']} failed")
+
+# Database setup shared by every entry point: the development server, gunicorn, the
+# flask CLI and the tests. Each step checks what is already there, so it is safe to repeat.
+_database_ready = False
+_database_lock = Lock()
+
+def migrate_database():
+    """Bring the database schema up to date: new columns, tables, indexes and the search index."""
+    # Check if the User table exists but doesn't have the 'role' column
+    inspector = inspect(db.engine)
+    if 'user' in inspector.get_table_names():
+        columns = [col['name'] for col in inspector.get_columns('user')]
+        if 'role' not in columns:
+            # Add the role column to the existing table
+            with db.engine.begin() as conn:
+                conn.execute(db.text('ALTER TABLE user ADD COLUMN role VARCHAR(20) DEFAULT "user" NOT NULL'))
+            print("Added 'role' column to User table")
+    
+    # Add the rating aggregate columns and fill them from the existing ratings
+    if 'resource' in inspector.get_table_names():
+        columns = [col['name'] for col in inspector.get_columns('resource')]
+        if 'rating_count' not in columns:
+            with db.engine.begin() as conn:
+                conn.execute(db.text('ALTER TABLE resource ADD COLUMN rating_count INTEGER DEFAULT 0 NOT NULL'))
+                conn.execute(db.text('ALTER TABLE resource ADD COLUMN rating_sum INTEGER DEFAULT 0 NOT NULL'))
+                conn.execute(db.text('ALTER TABLE resource ADD COLUMN rating_avg FLOAT DEFAULT 0 NOT NULL'))
+            print(f"Added rating aggregate columns, backfilled {reconcile_rating_aggregates()} resources")
+        elif 'rating_avg' not in columns:
+            with db.engine.begin() as conn:
+                conn.execute(db.text('ALTER TABLE resource ADD COLUMN rating_avg FLOAT DEFAULT 0 NOT NULL'))
+                conn.execute(db.text('UPDATE resource SET rating_avg = CAST(rating_sum AS FLOAT) / rating_count '
+                                     'WHERE rating_count > 0'))
+            print("Added the stored average rating column")
+    
+    # The chatbot text cache is disposable, so rebuild it if its schema is out of date
+    if 'resource_text' in inspector.get_table_names():
+        columns = [col['name'] for col in inspector.get_columns('resource_text')]
+        if 'status' not in columns:
+            ResourceText.__table__.drop(db.engine)
+            print("Dropped outdated resource_text table")
+        elif 'etag' not in columns:
+            with db.engine.begin() as conn:
+                conn.execute(db.text('ALTER TABLE resource_text ADD COLUMN etag VARCHAR(255)'))
+                conn.execute(db.text('ALTER TABLE resource_text ADD COLUMN last_modified VARCHAR(64)'))
+            print("Added HTTP validator columns to resource_text table")
+    
+    # Create all tables that don't exist yet
+    db.create_all()
+    
+    # create_all only adds indexes along with new tables, so add new ones to existing tables
+    for name in create_missing_indexes():
+        print(f"Created index {name}")
+    
+    # Create the full-text search index, indexing any resources added without it
+    create_search_index()
+
+@app.before_request
+def ensure_database():
+    """Run migrate_database once per process, before the first request is handled."""
+    global _database_ready
+    if _database_ready:
+        return
+    with _database_lock:
+        if not _database_ready:
+            migrate_database()
+            _database_ready = True
+
 if __name__ == '__main__':
     with app.app_context():
-        # Check if the User table exists but doesn't have the 'role' column
-        inspector = inspect(db.engine)
-        if 'user' in inspector.get_table_names():
-            columns = [col['name'] for col in inspector.get_columns('user')]
-            if 'role' not in columns:
-                # Add the role column to the existing table
-                with db.engine.begin() as conn:
-                    conn.execute(db.text('ALTER TABLE user ADD COLUMN role VARCHAR(20) DEFAULT "user" NOT NULL'))
-                print("Added 'role' column to User table")
-        
-        # Create all tables that don't exist yet
-        db.create_all()
+        migrate_database()
         
         # Add default categories if none exist
         if Category.query.count() == 0:
@@ -1218,6 +2415,7 @@ if __name__ == '__main__':
                 category = Category(name=category_data['name'], description=category_data['description'])
                 db.session.add(category)
             
+            bump_cache_version('categories')
             db.session.commit()
             print('Default categories added!')
         
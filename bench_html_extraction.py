@@ -0,0 +1,113 @@
+import re
+import sys
+import time
+import random
+from bs4 import BeautifulSoup
+
+import chatbot
+
+# Compares the chatbot's HTML text extraction engines with the original
+# BeautifulSoup implementation on a generated corpus of pages. Content words are
+# named "content<N>" and boilerplate words "boiler<N>", so quality can be scored
+# as the share of content words kept and boilerplate words leaked.
+#
+# Usage: python bench_html_extraction.py [runs]
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+def legacy_html_to_text(html):
+    """The extraction code extract_webpage_text used before the engines were added."""
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style", "header", "footer", "nav"]):
+        script.extract()
+    text = soup.get_text(separator=' ')
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def words(rng, prefix, count):
+    return ' '.join(f"{prefix}{rng.randrange(100000)}" for _ in range(count))
+
+def paragraphs(rng, prefix, count, length):
+    return ''.join(f"<p>{words(rng, prefix, length)} <a href='#'>{words(rng, prefix, 2)}</a></p>\n"
+                   for _ in range(count))
+
+def boilerplate(rng):
+    links = ''.join(f"<li><a href='/{i}'>{words(rng, 'boiler', 2)}</a></li>" for i in range(40))
+    return {
+        'head': f"<head><title>Page</title><style>.a{{color:red}} /* boiler1 */</style>"
+                f"<script>var boiler2 = 1;</script></head>",
+        'header': f"<header><div>{words(rng, 'boiler', 10)}</div></header>",
+        'nav': f"<nav><ul>{links}</ul></nav>",
+        'aside': f"<aside><h3>{words(rng, 'boiler', 3)}</h3><ul>{links}</ul></aside>",
+        'footer': f"<footer>{words(rng, 'boiler', 30)}<script>track('boiler3')</script></footer>",
+    }
+
+def docs_page(rng, sections):
+    """Documentation page with a sidebar and the content in <main>."""
+    b = boilerplate(rng)
+    body = ''.join(f"<section><h2>{words(rng, 'content', 4)}</h2>{paragraphs(rng, 'content', 6, 60)}"
+                   f"<pre><code>{words(rng, 'content', 40)}</code></pre></section>" for _ in range(sections))
+    return (f"<!DOCTYPE html><html>{b['head']}<body>{b['header']}{b['nav']}{b['aside']}"
+            f"<main>{body}</main>{b['footer']}</body></html>")
+
+def blog_post(rng):
+    """Blog post marked up with a single <article>."""
+    b = boilerplate(rng)
+    return (f"<html>{b['head']}<body>{b['header']}{b['nav']}"
+            f"<article><h1>{words(rng, 'content', 6)}</h1>{paragraphs(rng, 'content', 20, 80)}</article>"
+            f"{b['aside']}{b['footer']}</body></html>")
+
+def landmark_page(rng):
+    """Site template that marks its content as <main role="main">, with a sidebar outside it."""
+    b = boilerplate(rng)
+    return (f"<html>{b['head']}<body>{b['header']}{b['nav']}"
+            f"<main role=\"main\"><h1>{words(rng, 'content', 6)}</h1>{paragraphs(rng, 'content', 15, 60)}</main>"
+            f"{b['aside']}{b['footer']}</body></html>")
+
+def legacy_page(rng):
+    """Table-layout page without semantic markup, where everything but the removed tags is kept."""
+    b = boilerplate(rng)
+    return (f"<html>{b['head']}<body><table><tr><td>{b['nav']}</td>"
+            f"<td>{paragraphs(rng, 'content', 30, 50)}</td></tr></table>{b['footer']}</body></html>")
+
+def build_corpus():
+    rng = random.Random(42)
+    return {
+        'docs page (small)': docs_page(rng, 3),
+        'docs page (large)': docs_page(rng, 150),
+        'blog post': blog_post(rng),
+        'main role=main': landmark_page(rng),
+        'table layout': legacy_page(rng),
+    }
+
+def score(text):
+    tokens = text.split()
+    content = {t for t in tokens if t.startswith('content')}
+    leaked = sum(1 for t in tokens if 'boiler' in t)
+    return content, leaked
+
+def time_engine(func, html):
+    best = float('inf')
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        text = func(html)
+        best = min(best, time.perf_counter() - start)
+    return best, text
+
+engines = {'legacy': legacy_html_to_text}
+for name in chatbot.HTML_EXTRACTORS:
+    engines[name] = lambda html, name=name: chatbot.html_to_text(html, engine=name)
+
+if 'lxml' not in engines:
+    print("lxml is not installed, only the BeautifulSoup engines are compared.")
+
+for label, html in build_corpus().items():
+    print(f"\n{label} ({len(html) / 1024:.0f} KB)")
+    baseline_content = None
+    for name, func in engines.items():
+        seconds, text = time_engine(func, html)
+        content, leaked = score(text)
+        if baseline_content is None:
+            baseline_content = content
+        recall = len(content & baseline_content) / max(len(baseline_content), 1)
+        print(f"  {name:7s} {seconds * 1000:8.2f} ms   content kept {recall:6.1%}   boilerplate words {leaked}")
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# Mixed read/write benchmark for the SQLite settings. Several worker processes, each
+# with a few threads standing in for gunicorn workers, browse resource pages and post
+# comments, ratings and bookmarks against a scratch database through Flask's test
+# client. It runs once with SQLITE_PROFILE=default (rollback journal, writes from the
+# request threads) and once with the production profile (WAL, pragmas, writer thread).
+#
+# Usage: python bench_sqlite.py [--processes 4] [--threads 4] [--seconds 10] [--write-ratio 0.3]
+
+parser = argparse.ArgumentParser(description="Compare SQLite profiles under a mixed read/write load.")
+parser.add_argument("--processes", type=int, default=4)
+parser.add_argument("--threads", type=int, default=4, help="threads per process")
+parser.add_argument("--seconds", type=float, default=10)
+parser.add_argument("--write-ratio", type=float, default=0.3, help="fraction of requests that write")
+parser.add_argument("--resources", type=int, default=200)
+parser.add_argument("--role", choices=["seed", "worker"], help=argparse.SUPPRESS)
+parser.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+PASSWORD = "bench"
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def users_needed():
+    return args.processes * args.threads
+
+def seed():
+    """Create the users, resources and some comments in a fresh database."""
+    from werkzeug.security import generate_password_hash
+    from app import app, db, User, Resource, Comment
+    with app.app_context():
+        db.create_all()
+        password = generate_password_hash(PASSWORD, method="pbkdf2:sha256:1000")  # Fast to check
+        no_emails = json.dumps({"new_resources": False, "comments_on_resources": False, "ratings_on_resources": False})
+        users = [User(username=f"bench{i}", email=f"bench{i}@example.com", password=password, email_verified=True,
+                      notification_preferences=no_emails)
+                 for i in range(users_needed())]
+        db.session.add_all(users)
+        db.session.commit()
+        resources = [Resource(title=f"Resource {i}", description="Lecture notes " * 20, resource_type="link",
+                              content=f"https://example.com/{i}", user_id=users[i % len(users)].id)
+                     for i in range(args.resources)]
+        db.session.add_all(resources)
+        db.session.commit()
+        db.session.add_all(Comment(content="Helpful, thanks", user_id=users[0].id, resource_id=resource.id)
+                           for resource in resources for _ in range(3))
+        db.session.commit()
+
+def worker():
+    """Run the load from this process's threads and print the samples as JSON."""
+    from app import app
+    samples = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+
+    def run(user_index, barrier, deadline_holder):
+        rng = random.Random(user_index)
+        client = app.test_client()
+        client.post("/login", data={"email": f"bench{user_index}@example.com", "password": PASSWORD})
+        barrier.wait()
+        while time.perf_counter() < deadline_holder[0]:
+            resource_id = rng.randint(1, args.resources)
+            kind = "write" if rng.random() < args.write_ratio else "read"
+            start = time.perf_counter()
+            if kind == "read":
+                response = client.get(f"/resource/{resource_id}" if rng.random() < 0.5 else "/")
+            else:
+                action = rng.choice(("comment", "rate", "bookmark"))
+                if action == "comment":
+                    response = client.post(f"/resource/{resource_id}/comment", data={"content": "Nice one"})
+                elif action == "rate":
+                    response = client.post(f"/resource/{resource_id}/rate", data={"rating": rng.randint(1, 5)})
+                else:
+                    response = client.post(f"/resource/{resource_id}/bookmark")
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code >= 500:
+                    errors[kind] += 1
+                else:
+                    samples[kind].append(elapsed)
+
+    barrier = threading.Barrier(args.threads + 1)
+    deadline_holder = [float("inf")]
+    first_user = args.index * args.threads
+    threads = [threading.Thread(target=run, args=(first_user + i, barrier, deadline_holder))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    deadline_holder[0] = time.perf_counter() + args.seconds
+    for thread in threads:
+        thread.join()
+    print(json.dumps({"samples": samples, "errors": errors}))
+
+def run_profile(profile):
+    scratch = tempfile.mkdtemp(prefix=f"nestcircle-sqlite-{profile}-")
+    env = dict(os.environ,
+               SQLITE_PROFILE=profile,
+               DATABASE_URL="sqlite:///" + os.path.join(scratch, "bench.db"),
+               SESSION_FILE_DIR=os.path.join(scratch, "sessions"),
+               GEMINI_FAKE="1",
+               GEMINI_MODEL_CACHE=os.path.join(scratch, "gemini_model.txt"))
+    common = [sys.executable, __file__, "--processes", str(args.processes), "--threads", str(args.threads),
+              "--seconds", str(args.seconds), "--write-ratio", str(args.write_ratio),
+              "--resources", str(args.resources)]
+    subprocess.run(common + ["--role", "seed"], env=env, check=True, stdout=subprocess.DEVNULL)
+
+    workers = [subprocess.Popen(common + ["--role", "worker", "--index", str(i)], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+               for i in range(args.processes)]
+    samples = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    for process in workers:
+        output, _ = process.communicate()
+        # The app prints status lines at import, the results are the last line
+        result = json.loads(output.strip().splitlines()[-1])
+        for kind in samples:
+            samples[kind] += result["samples"][kind]
+            errors[kind] += result["errors"][kind]
+
+    print(f"\n{profile} profile")
+    print(f"  {'':6s} {'ok/s':>8s} {'errors':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s}")
+    for kind in ("read", "write"):
+        values = samples[kind]
+        print(f"  {kind:6s} {len(values) / args.seconds:8.1f} {errors[kind]:7d} "
+              f"{percentile(values, 50) * 1000:6.1f}ms {percentile(values, 95) * 1000:6.1f}ms "
+              f"{percentile(values, 99) * 1000:6.1f}ms")
+
+if args.role == "seed":
+    seed()
+elif args.role == "worker":
+    worker()
+else:
+    print(f"{args.processes} processes x {args.threads} threads for {args.seconds:g}s, "
+          f"{args.write_ratio:.0%} writes over {args.resources} resources")
+    for profile in ("default", "production"):
+        run_profile(profile)
@@ -0,0 +1,58 @@
+import os
+import sys
+import subprocess
+import tempfile
+
+# Measures how long the app takes to start serving, and how long the background
+# Gemini model probe takes with and without a cached model name.
+#
+# Usage: python bench_startup.py [runs]
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+# Runs in a fresh interpreter so import costs are measured from scratch
+MEASURE = r"""
+import time
+start = time.perf_counter()
+import app
+import chatbot
+imported = time.perf_counter() - start
+while chatbot.model_status in ('idle', 'initializing'):
+    time.sleep(0.05)
+ready = time.perf_counter() - start
+print(f"{imported:.3f} {ready:.3f} {chatbot.model_status}")
+"""
+
+def measure(env):
+    result = subprocess.run([sys.executable, "-c", MEASURE], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    # The measurement is the last line, everything before it is startup logging
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        print(result.stderr)
+        sys.exit(1)
+    imported, ready, status = lines[-1].split()
+    return float(imported), float(ready), status
+
+def run_scenario(label, env):
+    print(f"\n{label}")
+    imports, readies = [], []
+    for i in range(RUNS):
+        imported, ready, status = measure(env)
+        imports.append(imported)
+        readies.append(ready)
+        print(f"  run {i + 1}: app importable after {imported:.3f}s, model {status} after {ready:.3f}s")
+    print(f"  best: import {min(imports):.3f}s, model {min(readies):.3f}s")
+
+with tempfile.TemporaryDirectory() as tmp:
+    cache_file = os.path.join(tmp, "gemini_model.txt")
+    env = dict(os.environ, GEMINI_MODEL_CACHE=cache_file)
+    
+    # Without a cache every start probes the candidate models. Before startup was moved
+    # to the background, the "model ready" time was also the time to first request.
+    run_scenario("Cold start (no cached model name, probe runs in background)", env)
+    
+    if os.path.exists(cache_file):
+        run_scenario("Warm start (cached model name, probe skipped)", env)
+    else:
+        print("\nNo model passed the probe, so there is no cached name to benchmark a warm start with.")
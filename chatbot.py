@@ -1,23 +1,40 @@
 import os
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
 import PyPDF2
 import io
 import requests
-from youtube_transcript_api import YouTubeTranscriptApi, CouldNotRetrieveTranscript
+from youtube_transcript_api import (YouTubeTranscriptApi, CouldNotRetrieveTranscript, TranscriptsDisabled,
+                                    NoTranscriptFound, NoTranscriptAvailable, VideoUnavailable, InvalidVideoId)
 import sys
 import time
+import random
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from bs4 import BeautifulSoup
 import re
+import hashlib
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where the rate limit is per process
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
 
+# Use the offline stand-in from fake_gemini.py instead of the real API
+USE_FAKE_GEMINI = os.getenv("GEMINI_FAKE", "").lower() in ("1", "true", "yes")
+
 # Check if API key is set
 api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
-    print("WARNING: GEMINI_API_KEY is not set in the environment. The chatbot will not function properly.")
+    if not USE_FAKE_GEMINI:
+        print("WARNING: GEMINI_API_KEY is not set in the environment. The chatbot will not function properly.")
     api_key = "not_set"  # Placeholder to prevent errors during startup
 
 # Configure the Gemini API with timeout
@@ -41,99 +58,684 @@ safety_settings = [
 # Global variable to track if model works
 model_works = False
 model = None
+model_name = None
+model_status = 'idle'  # 'idle', 'initializing', 'ready', 'failed'
+
+# Last model name that passed the startup probe, so restarts can skip probing
+MODEL_CACHE_FILE = os.getenv(
+    "GEMINI_MODEL_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'gemini_model.txt')
+)
 
 class TimeoutError(Exception):
     pass
 
-def timeout_handler():
-    raise TimeoutError("API call timed out")
+class RateLimitTimeoutError(TimeoutError):
+    """Raised when a call gives up waiting for its turn under the rate limits."""
+    pass
 
-def with_timeout(func, timeout_seconds, *args, **kwargs):
-    """Run a function with a timeout."""
-    result = [None]
-    error = [None]
-    completed = [False]
+class GeminiBusyError(Exception):
+    """Raised when too many Gemini calls are already running or queued in this process."""
+    pass
+
+# All Gemini calls in this process share one bounded pool instead of a thread per call
+GEMINI_MAX_WORKERS = int(os.getenv("GEMINI_MAX_WORKERS", "8"))   # Calls running at once
+GEMINI_MAX_QUEUED = int(os.getenv("GEMINI_MAX_QUEUED", "16"))    # Calls waiting for a worker
+
+_gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_WORKERS, thread_name_prefix='gemini')
+_gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_WORKERS + GEMINI_MAX_QUEUED)
+_gemini_stats_lock = threading.Lock()
+_gemini_stats = {
+    'submitted': 0,
+    'completed': 0,
+    'failed': 0,
+    'timed_out': 0,
+    'rejected': 0,
+    'queued': 0,
+    'running': 0,
+    'throttled': 0,   # Calls that waited for the rate limiter
+    'retried': 0,     # Retries after a 429 or 5xx error
+}
+
+def _update_gemini_stats(**changes):
+    with _gemini_stats_lock:
+        for key, delta in changes.items():
+            _gemini_stats[key] += delta
+
+def get_gemini_stats():
+    """Return a snapshot of the Gemini call pool counters."""
+    with _gemini_stats_lock:
+        stats = dict(_gemini_stats)
+    stats['max_workers'] = GEMINI_MAX_WORKERS
+    stats['max_queued'] = GEMINI_MAX_QUEUED
+    stats['requests_per_minute'] = GEMINI_RPM
+    stats['tokens_per_minute'] = GEMINI_TPM
+    return stats
+
+def request_options(timeout):
+    """Per-call options so the HTTP client itself abandons calls that run past the timeout."""
+    return {'timeout': timeout}
+
+def submit_gemini_call(func, *args, **kwargs):
+    """Queue a function on the shared Gemini pool and return its future.
+    
+    Raises GeminiBusyError instead of queueing when the pool is full.
+    """
+    if not _gemini_slots.acquire(blocking=False):
+        _update_gemini_stats(rejected=1)
+        raise GeminiBusyError("Too many AI requests are in progress")
+    
+    _update_gemini_stats(submitted=1, queued=1)
     
     def worker():
+        _update_gemini_stats(queued=-1, running=1)
         try:
-            result[0] = func(*args, **kwargs)
-            completed[0] = True
+            return func(*args, **kwargs)
+        finally:
+            _update_gemini_stats(running=-1)
+    
+    def release(future):
+        _gemini_slots.release()
+        if future.cancelled():
+            _update_gemini_stats(queued=-1)
+        elif future.exception() is not None:
+            _update_gemini_stats(failed=1)
+        else:
+            _update_gemini_stats(completed=1)
+    
+    future = _gemini_executor.submit(worker)
+    future.add_done_callback(release)
+    return future
+
+def with_timeout(func, timeout_seconds, *args, **kwargs):
+    """Run a function on the shared Gemini pool with a timeout.
+    
+    Callers should also pass request_options(timeout) to the Gemini call so a stuck
+    request is torn down by the client rather than left running on a worker.
+    """
+    future = submit_gemini_call(func, *args, **kwargs)
+    
+    try:
+        return future.result(timeout=timeout_seconds)
+    except FutureTimeoutError:
+        # A call that never started is dropped; a running one ends at its request timeout
+        future.cancel()
+        _update_gemini_stats(timed_out=1)
+        raise TimeoutError(f"Function call timed out after {timeout_seconds} seconds")
+
+# Gemini quota limits. Requests are spaced to stay under them instead of failing with 429s.
+# 0 disables a limit. Set GEMINI_RATE_LIMIT_FILE to share the budget between worker processes.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))               # Requests per minute
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))          # Tokens per minute
+GEMINI_RATE_LIMIT_FILE = os.getenv("GEMINI_RATE_LIMIT_FILE")
+GEMINI_MAX_WAITING_PER_USER = int(os.getenv("GEMINI_MAX_WAITING_PER_USER", "3"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))  # Seconds before the first retry, at most
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "16.0"))
+# Tokens budgeted for an answer, on top of the prompt's estimate
+EXPECTED_RESPONSE_TOKENS = 500
+
+class TokenBucket:
+    """Refills at `per_minute` units per minute, holding at most a minute's worth."""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+    
+    def _refill(self, tokens, updated, now):
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+    
+    def try_acquire(self, amount):
+        """Take `amount` units if available. Returns 0 on success, otherwise the seconds to wait."""
+        amount = min(amount, self.capacity)
+        now = time.monotonic()
+        self.tokens = self._refill(self.tokens, self.updated, now)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+    
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+class FileTokenBucket(TokenBucket):
+    """A TokenBucket whose state lives in a locked file, shared by all processes on the host."""
+    def __init__(self, per_minute, path):
+        super().__init__(per_minute)
+        self.path = path
+    
+    def _update(self, change):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    tokens, updated = (float(x) for x in f.read().split())
+                except ValueError:
+                    tokens, updated = float(self.capacity), time.time()
+                now = time.time()
+                tokens, result = change(self._refill(tokens, updated, now))
+                f.seek(0)
+                f.truncate()
+                f.write(f"{tokens} {now}")
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def try_acquire(self, amount):
+        amount = min(amount, self.capacity)
+        def take(tokens):
+            if tokens >= amount:
+                return tokens - amount, 0
+            return tokens, (amount - tokens) / self.rate
+        return self._update(take)
+    
+    def refund(self, amount):
+        self._update(lambda tokens: (min(self.capacity, tokens + min(amount, self.capacity)), None))
+
+class FairRateLimiter:
+    """Admits Gemini calls within the token buckets, taking turns between users.
+    
+    Each user has a short queue of waiting calls. When budget frees up it goes to the
+    next user in round-robin order, so one user's burst cannot starve the others.
+    """
+    def __init__(self, buckets, max_waiting_per_user):
+        self.buckets = buckets
+        self.max_waiting_per_user = max_waiting_per_user
+        self._cond = threading.Condition()
+        self._queues = {}          # user -> deque of waiting tickets
+        self._turns = deque()      # users with waiting tickets, in turn order
+    
+    def _try_buckets(self, tokens):
+        """Take from every bucket, or from none. Returns the seconds to wait, 0 on success."""
+        taken = []
+        for bucket, amount in zip(self.buckets, (1, tokens)):
+            wait = bucket.try_acquire(amount)
+            if wait:
+                for previous, previous_amount in taken:
+                    previous.refund(previous_amount)
+                return wait
+            taken.append((bucket, amount))
+        return 0
+    
+    def acquire(self, user, tokens, timeout):
+        """Wait for a turn and budget for one call of about `tokens` tokens.
+        
+        Returns the seconds spent waiting, 0 if admitted straight away. Raises GeminiBusyError if the user already
+        has too many calls waiting, or RateLimitTimeoutError if no turn comes within `timeout`.
+        """
+        if not self.buckets:
+            return 0
+        
+        started = time.monotonic()
+        deadline = started + timeout
+        ticket = object()
+        waited = False
+        with self._cond:
+            queue_ = self._queues.setdefault(user, deque())
+            if len(queue_) >= self.max_waiting_per_user:
+                raise GeminiBusyError("Too many AI requests are waiting for this user")
+            queue_.append(ticket)
+            if len(queue_) == 1:
+                self._turns.append(user)
+            
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RateLimitTimeoutError("Timed out waiting for the AI request rate limit")
+                    
+                    if self._turns[0] == user and queue_[0] is ticket:
+                        wait = self._try_buckets(tokens)
+                        if not wait:
+                            return time.monotonic() - started if waited else 0
+                        self._cond.wait(min(wait, remaining))
+                    else:
+                        self._cond.wait(remaining)
+                    waited = True
+            finally:
+                # Pass the turn on, whether this call was admitted or gave up
+                was_turn = self._turns[0] == user and queue_[0] is ticket
+                queue_.remove(ticket)
+                if was_turn:
+                    self._turns.popleft()
+                    if queue_:
+                        self._turns.append(user)
+                elif not queue_:
+                    self._turns.remove(user)
+                if not queue_:
+                    del self._queues[user]
+                self._cond.notify_all()
+
+def _make_bucket(per_minute, name):
+    if GEMINI_RATE_LIMIT_FILE and fcntl is not None:
+        return FileTokenBucket(per_minute, f"{GEMINI_RATE_LIMIT_FILE}.{name}")
+    return TokenBucket(per_minute)
+
+rate_limiter = FairRateLimiter(
+    [_make_bucket(GEMINI_RPM, 'rpm')] + ([_make_bucket(GEMINI_TPM, 'tpm')] if GEMINI_TPM else [])
+    if GEMINI_RPM else [],
+    GEMINI_MAX_WAITING_PER_USER,
+)
+
+def estimate_tokens(prompt_size):
+    """Rough token count of a call from measure_prompt() sizes, about four characters per token."""
+    return prompt_size['total_chars'] // 4 + EXPECTED_RESPONSE_TOKENS
+
+def is_retryable_error(error):
+    """True for rate limit (429) and server (5xx) errors, which are worth retrying."""
+    if isinstance(error, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+                          google_exceptions.InternalServerError, google_exceptions.BadGateway,
+                          google_exceptions.ServiceUnavailable)):
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and (code == 429 or 500 <= code < 600)
+
+def backoff_delay(attempt):
+    """Seconds to wait before retry number `attempt` (0-based), with full jitter."""
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+
+# Model names to try, in order of preference
+MODEL_CANDIDATES = [
+    "gemini-2.0-flash",          # New 2.0 Flash model (faster) 
+    "gemini-pro",            # Standard model as fallback
+    "models/gemini-flash",   # Full path for Flash model
+    "models/gemini-pro"      # Full path for standard model
+]
+
+# Circuit breaker settings for routing calls between MODEL_CANDIDATES
+ROUTER_WINDOW = 20                 # Recent calls remembered per model
+ROUTER_MIN_CALLS = 5               # Calls needed before error rate and latency are judged
+ROUTER_MAX_ERROR_RATE = 0.5
+ROUTER_MAX_CONSECUTIVE_FAILURES = 2
+ROUTER_SLOW_SECONDS = float(os.getenv("GEMINI_SLOW_SECONDS", "15"))  # p90 latency that counts as degraded
+ROUTER_COOLDOWN = 30               # Seconds before the first recovery probe, doubled after each failed one
+ROUTER_MAX_COOLDOWN = 300
+ROUTER_PROBE_TIMEOUT = 10
+# Longest a single attempt may run, so a stuck model leaves time to fail over
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "20"))
+
+def is_model_failure(error):
+    """True if an error says something about the model's health rather than the request."""
+    return not isinstance(error, (GeminiBusyError, google_exceptions.InvalidArgument))
+
+class ModelRoute:
+    """One candidate model, with its recent call outcomes and circuit breaker state."""
+    def __init__(self, name, instance=None):
+        self.name = name
+        self._instance = instance
+        self.outcomes = deque(maxlen=ROUTER_WINDOW)  # (latency seconds, succeeded)
+        self.state = 'closed'      # 'closed' takes traffic, 'open' waits for a recovery probe
+        self.opened_at = None
+        self.cooldown = ROUTER_COOLDOWN
+        self.consecutive_failures = 0
+        self.calls = 0
+        self.failures = 0
+        self.last_error = None
+    
+    @property
+    def model(self):
+        if self._instance is None:
+            self._instance = create_model(self.name)
+        return self._instance
+    
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+    
+    def latency(self, pct):
+        latencies = sorted(latency for latency, ok in self.outcomes if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))]
+    
+    def retry_at(self):
+        return self.opened_at + self.cooldown if self.opened_at is not None else 0
+    
+    def stats(self):
+        p50, p90 = self.latency(50), self.latency(90)
+        return {
+            'model': self.name,
+            'state': self.state,
+            'calls': self.calls,
+            'failures': self.failures,
+            'recent_error_rate': round(self.error_rate(), 3),
+            'recent_p50_seconds': round(p50, 3) if p50 is not None else None,
+            'recent_p90_seconds': round(p90, 3) if p90 is not None else None,
+            'next_probe_in_seconds': round(max(0, self.retry_at() - time.monotonic()), 1) if self.state == 'open' else None,
+            'last_error': self.last_error,
+        }
+
+class ModelRouter:
+    """Sends each call to the most preferred model whose circuit breaker is closed.
+    
+    A model's breaker opens when its recent calls fail or get slow, and calls fail
+    over to the next candidate. A background thread probes open models and closes
+    their breakers once they answer quickly again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = []
+        self.decisions = deque(maxlen=50)  # Recent routing changes, newest last
+        self._current = None
+        self._probe_thread = None
+    
+    def set_routes(self, routes):
+        with self._lock:
+            self.routes = list(routes)
+            self._current = self.routes[0].name if self.routes else None
+    
+    def _log(self, event, model, reason):
+        print(f"Model router: {event} {model}: {reason}")
+        self.decisions.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'event': event,
+                               'model': model, 'reason': reason})
+    
+    def choose(self):
+        """Return the route for the next call."""
+        with self._lock:
+            if not self.routes:
+                # No routes were set up, e.g. the model was assigned directly
+                self.routes = [ModelRoute(model_name or 'default', model)]
+                self._current = self.routes[0].name
+            route = next((r for r in self.routes if r.state == 'closed'), None)
+            if route is None:
+                # Everything is degraded, so use the model due to recover soonest rather than fail
+                route = min(self.routes, key=ModelRoute.retry_at)
+            if route.name != self._current:
+                self._log('routing to', route.name, f"was {self._current}")
+                self._current = route.name
+            return route
+    
+    def _degraded_reason(self, route):
+        if route.consecutive_failures >= ROUTER_MAX_CONSECUTIVE_FAILURES:
+            return f"{route.consecutive_failures} failures in a row ({route.last_error})"
+        if len(route.outcomes) >= ROUTER_MIN_CALLS:
+            if route.error_rate() > ROUTER_MAX_ERROR_RATE:
+                return f"error rate {route.error_rate():.0%} over the last {len(route.outcomes)} calls"
+            p90 = route.latency(90)
+            if p90 is not None and p90 > ROUTER_SLOW_SECONDS:
+                return f"p90 latency {p90:.1f}s is over {ROUTER_SLOW_SECONDS:g}s"
+        return None
+    
+    def record(self, route, latency, ok, error=None):
+        """Record the outcome of a call, opening the route's breaker if it is degraded."""
+        with self._lock:
+            route.calls += 1
+            route.outcomes.append((latency, ok))
+            if ok:
+                route.consecutive_failures = 0
+            else:
+                route.failures += 1
+                route.consecutive_failures += 1
+                route.last_error = str(error)[:200] if error else 'timed out'
+            
+            if route.state == 'closed':
+                reason = self._degraded_reason(route)
+                if reason:
+                    route.state = 'open'
+                    route.opened_at = time.monotonic()
+                    self._log('opened breaker for', route.name, reason)
+                    self._start_probing()
+    
+    def recorder(self, route):
+        """Return a function that records one attempt's outcome, ignoring any later reports.
+        
+        Both the worker and a caller that gave up waiting may report the same attempt.
+        """
+        recorded = []
+        
+        def record(latency, ok, error=None):
+            if not recorded:
+                recorded.append(ok)
+                self.record(route, latency, ok, error)
+        return record
+    
+    def _start_probing(self):
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._probe_thread = threading.Thread(target=self._probe_loop, name='gemini-probe', daemon=True)
+            self._probe_thread.start()
+    
+    def _probe_loop(self):
+        while True:
+            with self._lock:
+                open_routes = [r for r in self.routes if r.state == 'open']
+            if not open_routes:
+                return
+            for route in open_routes:
+                if time.monotonic() >= route.retry_at():
+                    self._probe(route)
+            time.sleep(1)
+    
+    def _probe(self, route):
+        started = time.monotonic()
+        try:
+            rate_limiter.acquire('model-probe', 10, ROUTER_PROBE_TIMEOUT)
+            route.model.generate_content("Test", request_options=request_options(ROUTER_PROBE_TIMEOUT))
+            latency = time.monotonic() - started
+            error = None if latency <= ROUTER_SLOW_SECONDS else f"probe took {latency:.1f}s"
         except Exception as e:
-            error[0] = e
+            error = str(e)[:200] or type(e).__name__
+        
+        with self._lock:
+            if error is None:
+                route.state = 'closed'
+                route.outcomes.clear()
+                route.consecutive_failures = 0
+                route.cooldown = ROUTER_COOLDOWN
+                self._log('closed breaker for', route.name, "recovery probe succeeded")
+            else:
+                route.opened_at = time.monotonic()
+                route.cooldown = min(route.cooldown * 2, ROUTER_MAX_COOLDOWN)
+                route.last_error = error
+                self._log('kept breaker open for', route.name, f"recovery probe failed: {error}")
     
-    thread = threading.Thread(target=worker)
-    thread.daemon = True
-    thread.start()
-    thread.join(timeout_seconds)
+    def stats(self):
+        with self._lock:
+            return {
+                'current_model': self._current,
+                'models': [route.stats() for route in self.routes],
+                'decisions': list(self.decisions),
+            }
+
+model_router = ModelRouter()
+
+def call_gemini(make_call, timeout, user=None, tokens=EXPECTED_RESPONSE_TOKENS):
+    """Run a Gemini call on the pool within the rate limits, routed to a healthy model.
     
-    if completed[0]:
-        return result[0]
-    if error[0]:
-        raise error[0]
-    raise TimeoutError(f"Function call timed out after {timeout_seconds} seconds")
+    make_call(model, attempt_timeout) performs the call. Each attempt is capped at
+    GEMINI_ATTEMPT_TIMEOUT and recorded with the model router. A failure that moves
+    the router to another model is retried straight away there; 429s and 5xx errors
+    on the same model are retried with backoff. The timeout covers waiting for a turn,
+    every attempt and the backoff between them.
+    Raises TimeoutError, GeminiBusyError, or the last error from the call.
+    """
+    deadline = time.monotonic() + timeout
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        route = model_router.choose()
+        waited = rate_limiter.acquire(user, tokens, deadline - time.monotonic())
+        if waited:
+            _update_gemini_stats(throttled=1)
+        
+        attempt_timeout = max(min(GEMINI_ATTEMPT_TIMEOUT, deadline - time.monotonic()), 0.1)
+        record = model_router.recorder(route)
+        
+        def run():
+            started = time.monotonic()
+            try:
+                result = make_call(route.model, attempt_timeout)
+            except Exception as e:
+                if is_model_failure(e):
+                    record(time.monotonic() - started, False, e)
+                raise
+            record(time.monotonic() - started, True)
+            return result
+        
+        try:
+            return with_timeout(run, attempt_timeout)
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                record(attempt_timeout, False)
+            if attempt == GEMINI_MAX_RETRIES or not is_model_failure(e):
+                raise
+            
+            if model_router.choose() is not route:
+                if deadline - time.monotonic() < 1:
+                    raise
+                print(f"Gemini call to {route.name} failed, failing over: {str(e)}")
+                _update_gemini_stats(retried=1)
+                continue
+            
+            if isinstance(e, TimeoutError) or not is_retryable_error(e):
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            print(f"Gemini call failed with a retryable error, retrying in {delay:.1f}s: {str(e)}")
+            _update_gemini_stats(retried=1)
+            time.sleep(delay)
+
+def load_cached_model_name():
+    """Return the last model name known to work, or None."""
+    try:
+        with open(MODEL_CACHE_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def save_cached_model_name(name):
+    """Remember a working model name for the next startup."""
+    try:
+        os.makedirs(os.path.dirname(MODEL_CACHE_FILE), exist_ok=True)
+        with open(MODEL_CACHE_FILE, 'w') as f:
+            f.write(name)
+    except OSError as e:
+        print(f"Could not save model name cache: {str(e)}")
+
+def create_model(name):
+    """Create a model object. This is local, no API call is made."""
+    return genai.GenerativeModel(
+        model_name=name,
+        generation_config=generation_config,
+        safety_settings=safety_settings
+    )
 
 def initialize_model(timeout=20):
     """Initialize the Gemini model with the appropriate model name based on availability."""
-    global model, model_works
+    global model, model_works, model_name, model_status
+    
+    if USE_FAKE_GEMINI:
+        import fake_gemini
+        print("Using the offline fake Gemini model")
+        return fake_gemini.install()
     
     if api_key == "not_set":
         print("Cannot initialize model without a valid API key")
+        model_status = 'failed'
         return None
-        
-    # Model names to try, in order of preference
-    models_to_try = [
-        "gemini-2.0-flash",          # New 2.0 Flash model (faster) 
-        "gemini-pro",            # Standard model as fallback
-        "models/gemini-flash",   # Full path for Flash model
-        "models/gemini-pro"      # Full path for standard model
-    ]
     
-    for model_name in models_to_try:
+    model_status = 'initializing'
+    
+    # A model that worked last time is used straight away without a test prompt
+    cached_name = load_cached_model_name()
+    if cached_name:
+        print(f"Using cached model name: {cached_name}")
+        model = create_model(cached_name)
+        model_name = cached_name
+        model_works = True
+        model_status = 'ready'
+        set_model_routes(cached_name, model)
+        return model
+    
+    for candidate in MODEL_CANDIDATES:
         try:
-            print(f"Trying to initialize model: {model_name}")
-            
-            # Create the model with a timeout
-            def create_model():
-                return genai.GenerativeModel(
-                    model_name=model_name,
-                    generation_config=generation_config,
-                    safety_settings=safety_settings
-                )
-            
-            model_instance = with_timeout(create_model, timeout)
+            print(f"Trying to initialize model: {candidate}")
+            model_instance = create_model(candidate)
             
             # Test the model with a simple prompt
             def test_model():
-                return model_instance.generate_content("Test")
+                return model_instance.generate_content("Test", request_options=request_options(timeout))
             
             try:
-                print(f"Testing model {model_name}...")
+                print(f"Testing model {candidate}...")
                 response = with_timeout(test_model, timeout)
-                print(f"Successfully initialized model: {model_name}")
-                model_works = True
+                print(f"Successfully initialized model: {candidate}")
                 model = model_instance
+                model_name = candidate
+                model_works = True
+                model_status = 'ready'
+                save_cached_model_name(candidate)
+                set_model_routes(candidate, model)
                 return model
             except TimeoutError:
-                print(f"Model {model_name} timed out during testing")
+                print(f"Model {candidate} timed out during testing")
             except Exception as test_error:
-                print(f"Model {model_name} failed during testing: {str(test_error)}")
+                print(f"Model {candidate} failed during testing: {str(test_error)}")
                 
-        except TimeoutError:
-            print(f"Model {model_name} initialization timed out")
         except Exception as e:
-            print(f"Failed to initialize model {model_name}: {str(e)}")
+            print(f"Failed to initialize model {candidate}: {str(e)}")
     
     # If we reach here, all models failed
     print("All model initialization attempts failed.")
+    model_status = 'failed'
     return None
 
-# Initialize the model
-print("Starting model initialization...")
-model = initialize_model()
-print(f"Model initialization complete. Model works: {model_works}")
+def set_model_routes(working_name, working_model):
+    """Route calls to the model that passed initialization first, then the other candidates."""
+    routes = [ModelRoute(working_name, working_model)]
+    routes += [ModelRoute(name) for name in MODEL_CANDIDATES if name != working_name]
+    model_router.set_routes(routes)
+
+_init_lock = threading.Lock()
+
+def start_model_initialization():
+    """Initialize the model on a background thread so startup is not blocked by the probe."""
+    global model_status
+    
+    with _init_lock:
+        if model_status != 'idle':
+            return
+        model_status = 'initializing'
+    
+    def run():
+        print("Starting model initialization...")
+        initialize_model()
+        print(f"Model initialization complete. Model works: {model_works}")
+    
+    threading.Thread(target=run, name='gemini-init', daemon=True).start()
+
+def model_ready():
+    """Return True once a working model is available."""
+    return model_works and model is not None
+
+# Most characters of resource text the chatbot keeps. Prompts only carry the
+# chunks relevant to each question, so this can be much larger than the prompt.
+MAX_RESOURCE_CHARS = 100000
+
+def iter_pdf_pages(reader, page_range=None):
+    """Lazily yield (page_number, text) for the pages of an open PdfReader.
+    
+    page_range is an optional 1-based, inclusive (start, end) tuple.
+    """
+    page_count = len(reader.pages)
+    start, end = page_range if page_range else (1, page_count)
+    start = max(start, 1)
+    end = min(end, page_count)
+    
+    for page_num in range(start, end + 1):
+        try:
+            page_text = reader.pages[page_num - 1].extract_text()
+            if page_text:
+                yield page_num, page_text
+            else:
+                print(f"Warning: No text extracted from page {page_num}")
+        except Exception as page_error:
+            print(f"Error extracting text from page {page_num}: {str(page_error)}")
 
-def extract_pdf_text(pdf_path):
-    """Extract text from a PDF file."""
+def extract_pdf_text(pdf_path, max_chars=None, page_range=None):
+    """Extract text from a PDF file, stopping once max_chars characters have been read."""
     try:
         print(f"Attempting to read PDF from: {pdf_path}")
         
@@ -152,7 +754,6 @@ def extract_pdf_text(pdf_path):
             print(error_msg)
             return f"Error: {error_msg}"
             
-        text = ""
         with open(pdf_path, 'rb') as file:
             try:
                 reader = PyPDF2.PdfReader(file)
@@ -164,15 +765,22 @@ def extract_pdf_text(pdf_path):
                 page_count = len(reader.pages)
                 print(f"PDF has {page_count} pages")
                 
-                for page_num in range(page_count):
-                    try:
-                        page_text = reader.pages[page_num].extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                        else:
-                            print(f"Warning: No text extracted from page {page_num+1}")
-                    except Exception as page_error:
-                        print(f"Error extracting text from page {page_num+1}: {str(page_error)}")
+                if page_range and (page_range[0] > page_count or page_range[0] > page_range[1]):
+                    return f"Error: Invalid page range {page_range[0]}-{page_range[1]} for a PDF with {page_count} pages."
+                
+                # Collect page chunks and join once, pages past the budget are never parsed
+                chunks = []
+                length = 0
+                for page_num, page_text in iter_pdf_pages(reader, page_range):
+                    chunks.append(page_text)
+                    length += len(page_text) + 1
+                    if max_chars is not None and length >= max_chars:
+                        print(f"Reached {max_chars} character budget at page {page_num}")
+                        break
+                
+                text = "\n".join(chunks)
+                if max_chars is not None:
+                    text = text[:max_chars]
                 
                 # If we didn't get any text but no errors occurred, the PDF might be image-based
                 if not text.strip():
@@ -188,60 +796,172 @@ def extract_pdf_text(pdf_path):
         print(error_msg)
         return f"Error: {error_msg}"
 
-def extract_webpage_text(url):
-    """Extract text from a webpage using BeautifulSoup for better HTML parsing."""
+# Shared HTTP session, so repeated page fetches reuse pooled connections
+HTTP_POOL_SIZE = int(os.getenv("CHATBOT_HTTP_POOL_SIZE", "10"))
+HTTP_TIMEOUT = 15
+# Pages larger than this are not downloaded
+MAX_WEBPAGE_BYTES = int(os.getenv("CHATBOT_MAX_WEBPAGE_BYTES", str(5 * 1024 * 1024)))
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+http_session = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+http_session.mount('http://', _http_adapter)
+http_session.mount('https://', _http_adapter)
+# Set a user agent to avoid being blocked
+http_session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional, BeautifulSoup's html.parser is used without it
+    lxml = None
+
+# Elements whose text is never page content
+BOILERPLATE_TAGS = ("script", "style", "header", "footer", "nav", "noscript", "template", "svg")
+# A <main>/<article> element is only trusted as the page content if it has at least this much text
+MIN_MAIN_CONTENT_CHARS = 200
+HTML_EXTRACTOR = os.getenv("CHATBOT_HTML_EXTRACTOR", "auto")  # 'auto', 'lxml' or 'bs4'
+
+def collapse_whitespace(text):
+    return ' '.join(text.split())
+
+def _extract_html_lxml(html):
+    """Extract text with lxml's C parser."""
+    if isinstance(html, str):
+        # lxml rejects str input that carries an XML encoding declaration
+        html = html.encode('utf-8')
+    doc = lxml.html.document_fromstring(html, parser=lxml.html.HTMLParser(encoding='utf-8'))
+    
+    # Empty boilerplate elements but keep their tails, so surrounding words stay apart
+    for element in list(doc.iter(*BOILERPLATE_TAGS)):
+        element.clear(keep_tail=True)
+    
+    # Prefer the page's main content when it is marked up
+    candidates = doc.xpath('//main | //*[@role="main"]') or doc.xpath('//article')
+    if len(candidates) == 1:
+        main_text = collapse_whitespace(' '.join(candidates[0].itertext()))
+        if len(main_text) >= MIN_MAIN_CONTENT_CHARS:
+            return main_text
+    
+    return collapse_whitespace(' '.join(doc.itertext()))
+
+def _extract_html_bs4(html):
+    """Extract text with BeautifulSoup's pure-Python parser."""
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    for element in soup(BOILERPLATE_TAGS):
+        element.decompose()
+    
+    # A CSS selector list matches each element once, like the XPath union in the lxml engine
+    candidates = soup.select('main, [role=main]') or soup.find_all('article')
+    if len(candidates) == 1:
+        main_text = collapse_whitespace(candidates[0].get_text(separator=' '))
+        if len(main_text) >= MIN_MAIN_CONTENT_CHARS:
+            return main_text
+    
+    return collapse_whitespace(soup.get_text(separator=' '))
+
+HTML_EXTRACTORS = {'bs4': _extract_html_bs4}
+if lxml is not None:
+    HTML_EXTRACTORS['lxml'] = _extract_html_lxml
+
+def html_to_text(html, engine=None):
+    """Return the visible text of an HTML document with whitespace collapsed.
+    
+    Uses lxml when it is installed, unless `engine` or CHATBOT_HTML_EXTRACTOR names
+    another one. If the page has a single <main> or <article> with enough text,
+    only that element is returned, which drops sidebars and other boilerplate.
+    """
+    engine = engine or HTML_EXTRACTOR
+    if engine == 'auto':
+        engine = 'lxml' if 'lxml' in HTML_EXTRACTORS else 'bs4'
+    if engine not in HTML_EXTRACTORS:
+        raise ValueError(f"Unknown or unavailable HTML extractor: {engine}")
+    return HTML_EXTRACTORS[engine](html)
+
+def fetch_webpage_text(url, etag=None, last_modified=None):
+    """Fetch a webpage and extract its text, revalidating against earlier validators.
+    
+    Returns (text, validators). text is None when the server reports the page is
+    unchanged (HTTP 304), and validators holds the 'etag' and 'last_modified' to
+    send next time. The body is streamed and abandoned as soon as it is known to
+    be too large or not HTML.
+    """
     try:
         print(f"Fetching webpage content from: {url}")
         
-        # Set a user agent to avoid being blocked
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
         
-        response = requests.get(url, headers=headers, timeout=15)
-        if response.status_code != 200:
-            return f"Error fetching webpage: HTTP {response.status_code}"
+        with http_session.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as response:
+            validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
             
-        # Get content type to check if it's HTML
-        content_type = response.headers.get('Content-Type', '').lower()
-        if 'text/html' not in content_type:
-            return f"URL does not point to HTML content: {content_type}"
+            if response.status_code == 304:
+                print(f"Webpage not modified: {url}")
+                return None, {'etag': validators['etag'] or etag,
+                              'last_modified': validators['last_modified'] or last_modified}
             
-        # Parse HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style", "header", "footer", "nav"]):
-            script.extract()
+            if response.status_code != 200:
+                return f"Error fetching webpage: HTTP {response.status_code}", {}
             
-        # Get text and clean it
-        text = soup.get_text(separator=' ')
-        
-        # Clean up whitespace
-        text = re.sub(r'\s+', ' ', text)
-        text = text.strip()
+            # Check the content type before downloading the body
+            content_type = response.headers.get('Content-Type', '').lower()
+            if not content_type.startswith(HTML_CONTENT_TYPES):
+                return f"Error: URL does not point to HTML content: {content_type}", {}
+            
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > MAX_WEBPAGE_BYTES:
+                return f"Error: Webpage is larger than {MAX_WEBPAGE_BYTES} bytes.", {}
+            
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                body += chunk
+                if len(body) > MAX_WEBPAGE_BYTES:
+                    return f"Error: Webpage is larger than {MAX_WEBPAGE_BYTES} bytes.", {}
+            
+            html = body.decode(response.encoding or 'utf-8', errors='replace')
         
+        text = html_to_text(html)
         if not text:
-            return "Error: No text content found on the webpage."
+            return "Error: No text content found on the webpage.", {}
             
         print(f"Successfully extracted {len(text)} characters from webpage")
-        return text
+        return text, validators
     except Exception as e:
         print(f"Error extracting webpage text: {str(e)}")
-        return f"Error extracting webpage text: {str(e)}"
+        return f"Error extracting webpage text: {str(e)}", {}
 
-def extract_youtube_transcript(video_id):
-    """Extract transcript from a YouTube video with better error handling."""
+def extract_webpage_text(url):
+    """Extract text from a webpage, always downloading it."""
+    text, _ = fetch_webpage_text(url)
+    return text
+
+# Failures that will not go away by retrying, so they can be cached
+PERMANENT_TRANSCRIPT_ERRORS = (TranscriptsDisabled, NoTranscriptFound, NoTranscriptAvailable,
+                               VideoUnavailable, InvalidVideoId)
+
+def fetch_youtube_transcript(video_id):
+    """Fetch the transcript of a YouTube video.
+    
+    Returns (status, text) where status is 'ready', 'unavailable' for failures that
+    retrying will not fix (e.g. subtitles disabled), or 'error' for transient ones.
+    text is the transcript or an error message.
+    """
     try:
         if not video_id:
             print("No video ID provided for transcript extraction")
-            return "Error: No valid YouTube video ID found in the URL."
+            return 'unavailable', "Error: No valid YouTube video ID found in the URL."
             
         print(f"Fetching transcript for YouTube video: {video_id}")
         
         transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
         if not transcript_list:
-            return "Error: No transcript available for this video (it might be disabled or the video might not have one)."
+            return 'unavailable', "Error: No transcript available for this video (it might be disabled or the video might not have one)."
             
         transcript = " ".join([item['text'] for item in transcript_list])
         
@@ -249,21 +969,28 @@ def extract_youtube_transcript(video_id):
         transcript = f"YouTube Video ID: {video_id}\n\n{transcript}"
         
         print(f"Successfully extracted transcript of length {len(transcript)}")
-        return transcript
+        return 'ready', transcript
     except CouldNotRetrieveTranscript as e:
         error_msg = str(e)
         print(f"YouTubeTranscriptApi error: {error_msg}")
-        if "subtitles are disabled" in error_msg.lower():
-            return "Error: Cannot retrieve transcript because subtitles are disabled for this video."
-        elif "no transcript found" in error_msg.lower():
-            return "Error: No transcript or subtitles found for this video."
+        status = 'unavailable' if isinstance(e, PERMANENT_TRANSCRIPT_ERRORS) else 'error'
+        if isinstance(e, TranscriptsDisabled) or "subtitles are disabled" in error_msg.lower():
+            return status, "Error: Cannot retrieve transcript because subtitles are disabled for this video."
+        elif isinstance(e, NoTranscriptFound) or "no transcript found" in error_msg.lower():
+            return status, "Error: No transcript or subtitles found for this video."
         else:
-            return f"Error: Could not retrieve transcript. The video may not have one, or an API error occurred: {error_msg}"
+            return status, f"Error: Could not retrieve transcript. The video may not have one, or an API error occurred: {error_msg}"
     except Exception as e:
         error_msg = str(e)
         print(f"Error extracting YouTube transcript: {error_msg}")
-        return f"Error extracting YouTube transcript: {error_msg}"
+        return 'error', f"Error extracting YouTube transcript: {error_msg}"
+
+def extract_youtube_transcript(video_id):
+    """Extract transcript from a YouTube video with better error handling."""
+    _, text = fetch_youtube_transcript(video_id)
+    return text
 
+@lru_cache(maxsize=4096)
 def extract_youtube_id(url):
     """Extract YouTube video ID from URL with improved handling of different formats."""
     try:
@@ -321,14 +1048,17 @@ def extract_youtube_id(url):
         print(f"Error extracting YouTube ID: {str(e)}")
         return None
 
-def get_resource_text(resource_type, content):
-    """Get text from different resource types."""
+def get_resource_text(resource_type, content, max_chars=None, page_range=None):
+    """Get text from different resource types.
+    
+    max_chars caps the returned text; page_range selects PDF pages as a 1-based (start, end) tuple.
+    """
     if resource_type == 'pdf':
         # Assuming content is a path to the PDF file
-        return extract_pdf_text(content)
+        return extract_pdf_text(content, max_chars=max_chars, page_range=page_range)
     elif resource_type == 'link':
         # Web link
-        return extract_webpage_text(content)
+        text = extract_webpage_text(content)
     elif resource_type == 'youtube':
         # Check if it's a playlist URL
         if 'list=' in content:
@@ -338,74 +1068,360 @@ def get_resource_text(resource_type, content):
         # YouTube video
         video_id = extract_youtube_id(content)
         if video_id:
-            return extract_youtube_transcript(video_id)
+            text = extract_youtube_transcript(video_id)
         else:
             return "Error: Could not extract a valid YouTube video ID from the provided URL for chatbot processing."
     else:
         return "Error: Unsupported resource type for chatbot processing."
+    
+    return text[:max_chars] if max_chars is not None else text
+
+# How long extracted text stays valid, in seconds, per resource type. PDFs are
+# fingerprinted on the file itself, so they only go stale when the file changes.
+TEXT_CACHE_TTLS = {
+    'pdf': None,
+    'link': 60 * 60 * 24,          # Web pages change, re-fetch daily
+    'youtube': 60 * 60 * 24 * 7,   # Transcripts rarely change
+}
+
+def content_fingerprint(resource_type, content):
+    """Fingerprint resource content so cached text can be matched to it."""
+    if resource_type == 'pdf' and os.path.isfile(content):
+        # Size and mtime change whenever the file is replaced, without reading it
+        stat = os.stat(content)
+        key = f"pdf:{content}:{stat.st_size}:{stat.st_mtime_ns}"
+    else:
+        key = f"{resource_type}:{content}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+# Retrieval settings for building prompt context from long resources
+CHUNK_CHARS = 1200          # Target size of each indexed chunk
+CHUNK_OVERLAP = 200         # Overlap so sentences on a boundary appear in both chunks
+TOP_K_CHUNKS = 5            # Chunks sent with each question
+MAX_CONTEXT_CHARS = 8000    # Resources shorter than this are sent whole
+MAX_CACHED_INDEXES = 32     # Chunk indexes kept in memory, least recently used evicted
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i in is it its "
+    "me my of on or please so that the their them then there these this those to "
+    "was were what when where which who why will with you your".split()
+)
+
+def tokenize(text):
+    """Lowercase text and split it into search terms, dropping stopwords."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+def split_into_chunks(text, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Split text into overlapping chunks, breaking on whitespace where possible."""
+    chunks = []
+    start = 0
+    length = len(text)
+    
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            # Prefer to break on a space in the second half of the chunk
+            space = text.rfind(' ', start + chunk_chars // 2, end)
+            if space != -1:
+                end = space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    
+    return chunks
+
+class ChunkIndex:
+    """BM25 index over the chunks of a single resource's text."""
+    k1 = 1.5
+    b = 0.75
+    
+    def __init__(self, text):
+        self.chunks = split_into_chunks(text)
+        chunk_count = len(self.chunks)
+        
+        postings = {}  # term -> ([chunk numbers], [term frequencies])
+        lengths = np.zeros(chunk_count)
+        for i, chunk in enumerate(self.chunks):
+            counts = Counter(tokenize(chunk))
+            lengths[i] = sum(counts.values())
+            for term, frequency in counts.items():
+                chunk_ids, frequencies = postings.setdefault(term, ([], []))
+                chunk_ids.append(i)
+                frequencies.append(frequency)
+        
+        self.postings = {
+            term: (np.array(chunk_ids), np.array(frequencies, dtype=float))
+            for term, (chunk_ids, frequencies) in postings.items()
+        }
+        # Per-chunk length normalisation from the BM25 formula
+        average_length = lengths.mean() if chunk_count else 0
+        if average_length:
+            self.length_norm = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        else:
+            self.length_norm = np.full(chunk_count, self.k1)
+    
+    def search(self, query, k=TOP_K_CHUNKS):
+        """Return up to k chunks relevant to the query, in document order."""
+        chunk_count = len(self.chunks)
+        scores = np.zeros(chunk_count)
+        
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            chunk_ids, frequencies = self.postings[term]
+            idf = np.log(1 + (chunk_count - len(chunk_ids) + 0.5) / (len(chunk_ids) + 0.5))
+            scores[chunk_ids] += idf * frequencies * (self.k1 + 1) / (frequencies + self.length_norm[chunk_ids])
+        
+        if not scores.any():
+            # Nothing matched (e.g. "summarize this"), so sample chunks across the whole document
+            picks = np.linspace(0, chunk_count - 1, num=min(k, chunk_count)).round().astype(int)
+            return [self.chunks[i] for i in sorted(set(picks.tolist()))]
+        
+        top = [i for i in np.argsort(-scores)[:k] if scores[i] > 0]
+        return [self.chunks[i] for i in sorted(top)]
+
+def text_fingerprint(text):
+    """Hash extracted text, so caches follow the content rather than the resource id."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
-def chat_with_gemini(prompt, resource_text=None, chat_history=None, timeout=30):
-    """Chat with Gemini API."""
+_chunk_indexes = OrderedDict()
+_chunk_indexes_lock = threading.Lock()
+
+def get_chunk_index(resource_text):
+    """Return the chunk index for some resource text, building it on first use."""
+    key = text_fingerprint(resource_text)
+    
+    with _chunk_indexes_lock:
+        index = _chunk_indexes.get(key)
+        if index is not None:
+            _chunk_indexes.move_to_end(key)
+            return index
+    
+    # Build outside the lock, a duplicate build is harmless
+    index = ChunkIndex(resource_text)
+    with _chunk_indexes_lock:
+        _chunk_indexes[key] = index
+        while len(_chunk_indexes) > MAX_CACHED_INDEXES:
+            _chunk_indexes.popitem(last=False)
+    return index
+
+def build_context(resource_text, prompt, k=TOP_K_CHUNKS):
+    """Select the parts of a resource relevant to a prompt."""
+    if len(resource_text) <= MAX_CONTEXT_CHARS:
+        return resource_text
+    chunks = get_chunk_index(resource_text).search(prompt, k)
+    return "\n...\n".join(chunks)
+
+class ResponseCache:
+    """Least-recently-used cache of chatbot answers, with entries expiring after ttl seconds."""
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, response_text)
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, key, response_text):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, response_text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'max_entries': self.max_entries, 'ttl': self.ttl}
+
+# Answers to opening prompts ("summarize this", "make a quiz") are shared between users
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("CHATBOT_RESPONSE_CACHE_SIZE", "512")),
+    ttl=int(os.getenv("CHATBOT_RESPONSE_CACHE_TTL", str(60 * 60 * 6)))
+)
+
+def normalize_prompt(prompt):
+    """Normalize a prompt so trivially different phrasings share a cache entry."""
+    return " ".join(prompt.lower().split()).rstrip(" .!?")
+
+def response_cache_key(prompt, resource_text, chat_history):
+    """Return the response cache key for a prompt, or None if it must not be cached.
+    
+    Only the first turn of a conversation about a resource is cached; later turns
+    depend on the conversation so far.
+    """
+    if chat_history or not resource_text:
+        return None
+    return f"{text_fingerprint(resource_text)}:{normalize_prompt(prompt)}"
+
+def turn_history(prompt, response_text):
+    """Return the history entries recorded for one exchange: the bare question and the answer."""
+    return [
+        {'role': 'user', 'parts': [prompt]},
+        {'role': 'model', 'parts': [response_text]},
+    ]
+
+def history_entry_to_dict(entry):
+    """Convert a chat history entry from the Gemini client into a plain dict."""
+    if isinstance(entry, dict):
+        return {'role': entry['role'], 'parts': [str(part) for part in entry['parts']]}
+    return {'role': entry.role, 'parts': [part.text for part in entry.parts]}
+
+BUSY_MESSAGE = "The AI assistant is busy right now. Please try again in a moment."
+UNAVAILABLE_MESSAGE = ("The AI chatbot is currently unavailable. "
+                       "Please check the API key configuration in the .env file and ensure "
+                       "you have a valid Google AI API key.")
+
+PINNED_REPLY = "Understood. I'll answer your questions using this resource."
+
+def pinned_history(resource_text):
+    """Opening turns that give the model the resource once per conversation.
+    
+    They are prepended when a chat starts but never stored, so the resource is not
+    copied into the history again on every turn.
+    """
+    if not resource_text:
+        return []
+    # Short resources are pinned whole, long ones as a sample from across the document
+    overview = build_context(resource_text, "")
+    return [
+        {'role': 'user', 'parts': [f"You are helping a student with a learning resource. "
+                                   f"Context information from the resource:\n{overview}"]},
+        {'role': 'model', 'parts': [PINNED_REPLY]},
+    ]
+
+def build_prompt(prompt, resource_text=None):
+    """Return the message sent for a turn.
+    
+    Short resources are already pinned in full, so only the question is sent. For long
+    ones the excerpts relevant to this question are attached, but only the question
+    is kept in the history.
+    """
+    if resource_text and len(resource_text) > MAX_CONTEXT_CHARS:
+        return f"Relevant excerpts from the resource:\n{build_context(resource_text, prompt)}\n\nUser query: {prompt}"
+    return prompt
+
+def _history_chars(history):
+    return sum(len(part) for entry in history for part in history_entry_to_dict(entry)['parts'])
+
+def measure_prompt(prompt, resource_text=None, chat_history=None):
+    """Return the size in characters of what a chat turn sends to the model."""
+    chat_history = chat_history or []
+    sizes = {
+        'turn': len(chat_history) // 2 + 1,
+        'pinned_chars': _history_chars(pinned_history(resource_text)),
+        'history_chars': _history_chars(chat_history),
+        'message_chars': len(build_prompt(prompt, resource_text)),
+    }
+    sizes['total_chars'] = sizes['pinned_chars'] + sizes['history_chars'] + sizes['message_chars']
+    return sizes
+
+_prompt_sizes = {}  # turn number -> [count, total characters]
+_prompt_sizes_lock = threading.Lock()
+
+def record_prompt_size(sizes):
+    """Add a turn's prompt size to the per-turn averages."""
+    with _prompt_sizes_lock:
+        totals = _prompt_sizes.setdefault(sizes['turn'], [0, 0])
+        totals[0] += 1
+        totals[1] += sizes['total_chars']
+
+def get_prompt_size_stats():
+    """Return the average prompt size in characters for each turn number seen."""
+    with _prompt_sizes_lock:
+        return {turn: round(total / count) for turn, (count, total) in sorted(_prompt_sizes.items())}
+
+def chat_with_gemini(prompt, resource_text=None, chat_history=None, timeout=30, user=None):
+    """Chat with Gemini API. `user` identifies the caller for the per-user fair queue."""
     global model, model_works
     
     # Check if model initialization succeeded
-    if not model_works or model is None:
-        error_msg = ("The AI chatbot is currently unavailable. "
-                    "Please check the API key configuration in the .env file and ensure "
-                    "you have a valid Google AI API key.")
-        print("Model not available: " + error_msg)
-        return error_msg, chat_history if chat_history else []
+    if not model_ready():
+        print("Model not available: " + UNAVAILABLE_MESSAGE)
+        return UNAVAILABLE_MESSAGE, chat_history if chat_history else []
         
     try:
-        # Prepare context
-        if resource_text:
-            context = f"Context information from the resource:\n{resource_text[:8000]}\n\nUser query: {prompt}"
-        else:
-            context = prompt
-            
-        # Define function to start chat
-        def start_chat():
-            if chat_history is None:
-                return model.start_chat(history=[])
-            else:
-                return model.start_chat(history=chat_history)
-                
-        # Start a chat session with timeout
+        chat_history = chat_history or []
+        message = build_prompt(prompt, resource_text)
+        
+        cache_key = response_cache_key(prompt, resource_text, chat_history)
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                print(f"Response cache hit for: {prompt[:50]}...")
+                return cached, chat_history + turn_history(prompt, cached)
+        
+        prompt_size = measure_prompt(prompt, resource_text, chat_history)
+        record_prompt_size(prompt_size)
+        tokens = estimate_tokens(prompt_size)
+        pinned = pinned_history(resource_text)
+        
         try:
-            print("Starting chat session...")
-            chat = with_timeout(start_chat, timeout)
-            
             # Define function to send message
-            def send_message():
-                return chat.send_message(context)
+            def send_message(routed_model, attempt_timeout):
+                # start_chat only builds a local session object, no API call is made.
+                # A fresh one per attempt keeps a failed attempt out of the history.
+                chat = routed_model.start_chat(history=pinned + chat_history)
+                return chat.send_message(message, request_options=request_options(attempt_timeout))
                 
-            # Generate response with timeout
+            # Generate response with timeout, retrying rate limit and server errors
+            deadline = time.monotonic() + timeout
             try:
                 print(f"Sending message to model: {prompt[:50]}...")
-                response = with_timeout(send_message, timeout)
+                response = call_gemini(send_message, timeout, user=user, tokens=tokens)
                 print(f"Received response from model: {str(response.text)[:50]}...")
-                return response.text, chat.history
+                if cache_key:
+                    response_cache.set(cache_key, response.text)
+                return response.text, chat_history + turn_history(prompt, response.text)
+            except RateLimitTimeoutError:
+                # The model was never called, a second attempt would only queue again
+                return "The AI model took too long to respond. Please try a simpler question.", chat_history
             except TimeoutError:
-                print("Message generation timed out, trying direct generation")
+                # The fallback shares the caller's deadline rather than starting a new one
+                remaining = deadline - time.monotonic()
+                if remaining < 1:
+                    return "The AI model took too long to respond. Please try a simpler question.", chat_history
+                print(f"Message generation timed out, trying direct generation with {remaining:.1f}s left")
                 
                 # Try a more direct approach with timeout if chat fails
-                def generate_content():
-                    return model.generate_content(context)
+                def generate_content(routed_model, attempt_timeout):
+                    contents = pinned + chat_history + [{'role': 'user', 'parts': [message]}]
+                    return routed_model.generate_content(contents, request_options=request_options(attempt_timeout))
                     
                 try:
-                    response = with_timeout(generate_content, timeout)
-                    return response.text, chat_history if chat_history else []
+                    response = call_gemini(generate_content, remaining, user=user, tokens=tokens)
+                    return response.text, chat_history + turn_history(prompt, response.text)
                 except TimeoutError:
-                    return "The AI model took too long to respond. Please try a simpler question.", chat_history if chat_history else []
+                    return "The AI model took too long to respond. Please try a simpler question.", chat_history
+                except GeminiBusyError:
+                    raise
                 except Exception as e2:
                     print(f"Error in generate_content: {str(e2)}")
-                    return f"Error generating response: {str(e2)}", chat_history if chat_history else []
+                    return f"Error generating response: {str(e2)}", chat_history
             
-        except TimeoutError:
-            return "The AI model took too long to initialize. Please try again later.", chat_history if chat_history else []
+        except GeminiBusyError:
+            print("Gemini call pool is full, rejecting request")
+            return BUSY_MESSAGE, chat_history
         except Exception as e:
             print(f"Error in chat.send_message: {str(e)}")
-            return f"Error in chat session: {str(e)}", chat_history if chat_history else []
+            return f"Error in chat session: {str(e)}", chat_history
             
     except Exception as e:
         error_message = str(e)
@@ -417,3 +1433,121 @@ def chat_with_gemini(prompt, resource_text=None, chat_history=None, timeout=30):
             return "Too many requests to the AI service. Please try again later.", chat_history if chat_history else []
         else:
             return f"Error generating response: {error_message}", chat_history if chat_history else []
+
+
+def stream_chat_with_gemini(prompt, resource_text=None, chat_history=None, timeout=30, user=None):
+    """Chat with Gemini API, yielding the response as it is generated.
+    
+    Yields ('text', chunk) events, then either ('done', history) or ('error', message).
+    The streaming call runs on the shared Gemini pool; timeout applies to the wait
+    for each chunk rather than to the whole response. Rate limit and server errors
+    are retried with backoff as long as no text has been sent yet.
+    """
+    if not model_ready():
+        print("Model not available: " + UNAVAILABLE_MESSAGE)
+        yield 'error', UNAVAILABLE_MESSAGE
+        return
+    
+    chat_history = chat_history or []
+    message = build_prompt(prompt, resource_text)
+    
+    cache_key = response_cache_key(prompt, resource_text, chat_history)
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            print(f"Response cache hit for: {prompt[:50]}...")
+            yield 'text', cached
+            yield 'done', chat_history + turn_history(prompt, cached)
+            return
+    
+    prompt_size = measure_prompt(prompt, resource_text, chat_history)
+    record_prompt_size(prompt_size)
+    tokens = estimate_tokens(prompt_size)
+    pinned = pinned_history(resource_text)
+    
+    def produce(events, route, record):
+        started = time.monotonic()
+        try:
+            chat = route.model.start_chat(history=pinned + chat_history)
+            response = chat.send_message(message, stream=True, request_options=request_options(timeout))
+            chunks = []
+            for chunk in response:
+                if chunk.text:
+                    if not chunks:
+                        # The router judges streamed calls by their time to first text
+                        record(time.monotonic() - started, True)
+                    chunks.append(chunk.text)
+                    events.put(('text', chunk.text))
+            response_text = "".join(chunks)
+            if cache_key:
+                response_cache.set(cache_key, response_text)
+            events.put(('done', chat_history + turn_history(prompt, response_text)))
+        except Exception as e:
+            print(f"Error in streaming response: {str(e)}")
+            if is_model_failure(e):
+                record(time.monotonic() - started, False, e)
+            events.put(('exception', e))
+    
+    deadline = time.monotonic() + timeout
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        events = queue.Queue()
+        route = model_router.choose()
+        record = model_router.recorder(route)
+        try:
+            waited = rate_limiter.acquire(user, tokens, deadline - time.monotonic())
+            if waited:
+                _update_gemini_stats(throttled=1)
+            print(f"Streaming message to model: {prompt[:50]}...")
+            future = submit_gemini_call(produce, events, route, record)
+        except GeminiBusyError:
+            print("Gemini call pool is full, rejecting request")
+            yield 'error', BUSY_MESSAGE
+            return
+        except TimeoutError:
+            yield 'error', "The AI model took too long to respond. Please try a simpler question."
+            return
+        
+        sent_text = False
+        while True:
+            # Waiting for the first text is capped so a stuck model leaves time to fail over
+            wait = timeout if sent_text else max(min(GEMINI_ATTEMPT_TIMEOUT, deadline - time.monotonic()), 0.1)
+            try:
+                event = events.get(timeout=wait)
+            except queue.Empty:
+                future.cancel()
+                _update_gemini_stats(timed_out=1)
+                if not sent_text:
+                    record(wait, False)
+                    if (attempt < GEMINI_MAX_RETRIES and model_router.choose() is not route
+                            and deadline - time.monotonic() >= 1):
+                        event = ('exception', TimeoutError(f"{route.name} timed out"))
+                        break
+                yield 'error', "The AI model took too long to respond. Please try a simpler question."
+                return
+            
+            if event[0] == 'exception':
+                break
+            yield event
+            if event[0] != 'text':
+                return
+            sent_text = True
+        
+        error = event[1]
+        if (not sent_text and is_model_failure(error) and attempt < GEMINI_MAX_RETRIES
+                and model_router.choose() is not route and deadline - time.monotonic() >= 1):
+            print(f"Streaming call to {route.name} failed, failing over: {str(error)}")
+            _update_gemini_stats(retried=1)
+            continue
+        
+        delay = backoff_delay(attempt)
+        if (sent_text or isinstance(error, TimeoutError) or not is_retryable_error(error)
+                or attempt == GEMINI_MAX_RETRIES or time.monotonic() + delay >= deadline):
+            if "429" in str(error):
+                yield 'error', "Too many requests to the AI service. Please try again later."
+            else:
+                yield 'error', f"Error generating response: {str(error)}"
+            return
+        
+        print(f"Streaming call failed with a retryable error, retrying in {delay:.1f}s: {str(error)}")
+        _update_gemini_stats(retried=1)
+        time.sleep(delay)
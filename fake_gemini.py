@@ -0,0 +1,127 @@
+import os
+import time
+import random
+import threading
+from google.api_core import exceptions as google_exceptions
+
+# Offline stand-in for a Gemini GenerativeModel, for load tests and local development.
+# It implements the parts of the google.generativeai API the chatbot uses
+# (start_chat, send_message and generate_content, with or without streaming) and
+# raises the same exception types as the real client for injected failures.
+#
+# Run the app against it with GEMINI_FAKE=1. The FAKE_GEMINI_* variables below
+# configure it, or call install() to swap it in from Python.
+
+WORDS = ("the resource explains this concept with an example and then compares it to related "
+         "ideas so that students can see how each step follows from the previous one").split()
+
+class FakeResponse:
+    """A response or streamed chunk, exposing .text like the real client."""
+    def __init__(self, text):
+        self.text = text
+
+class FakeGenerativeModel:
+    """Generates filler text after a configurable delay, with optional error injection.
+
+    latency is the delay before the first token, tokens_per_second the generation
+    speed after it, and error_rate / rate_limit_rate the fraction of calls that fail
+    with a 500 or a 429.
+    """
+    def __init__(self, latency=0.5, tokens_per_second=50, response_tokens=120,
+                 error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls):
+        seed = os.getenv("FAKE_GEMINI_SEED")
+        return cls(
+            latency=float(os.getenv("FAKE_GEMINI_LATENCY", "0.5")),
+            tokens_per_second=float(os.getenv("FAKE_GEMINI_TOKENS_PER_SECOND", "50")),
+            response_tokens=int(os.getenv("FAKE_GEMINI_RESPONSE_TOKENS", "120")),
+            error_rate=float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("FAKE_GEMINI_RATE_LIMIT_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history or [])
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        timeout = (request_options or {}).get('timeout')
+        return self._respond(stream, timeout)
+
+    def _respond(self, stream, timeout):
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+            words = [self._rng.choice(WORDS) for _ in range(self.response_tokens)]
+
+        if roll < self.rate_limit_rate:
+            time.sleep(min(self.latency, 0.05))
+            raise google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+
+        # Fail after the first-token delay, like a server error would
+        self._sleep(self.latency, timeout)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise google_exceptions.InternalServerError("An internal error has occurred.")
+
+        if stream:
+            return self._stream(words, timeout)
+        self._sleep(len(words) / self.tokens_per_second, timeout - self.latency if timeout else None)
+        return FakeResponse(" ".join(words))
+
+    def _stream(self, words, timeout):
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(1 / self.tokens_per_second)
+            yield FakeResponse(word if i == 0 else " " + word)
+
+    def _sleep(self, seconds, timeout):
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("Deadline Exceeded")
+        time.sleep(seconds)
+
+class FakeChatSession:
+    """Mirrors ChatSession: keeps the history and appends each exchange to it."""
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history)
+
+    def send_message(self, content, stream=False, request_options=None, **kwargs):
+        timeout = (request_options or {}).get('timeout')
+        response = self.model._respond(stream, timeout)
+        self.history.append({'role': 'user', 'parts': [content]})
+        if stream:
+            return self._record_stream(response)
+        self.history.append({'role': 'model', 'parts': [response.text]})
+        return response
+
+    def _record_stream(self, chunks):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk.text)
+            yield chunk
+        self.history.append({'role': 'model', 'parts': ["".join(parts)]})
+
+def install(**config):
+    """Replace the chatbot's Gemini model with a fake one and return it.
+
+    Keyword arguments are passed to FakeGenerativeModel; without any, the
+    FAKE_GEMINI_* environment variables are used.
+    """
+    import chatbot
+    fake = FakeGenerativeModel(**config) if config else FakeGenerativeModel.from_env()
+    chatbot.model = fake
+    chatbot.model_name = "fake-gemini"
+    chatbot.model_works = True
+    chatbot.model_status = 'ready'
+    chatbot.model_router.set_routes([chatbot.ModelRoute("fake-gemini", fake)])
+    return fake
@@ -0,0 +1,174 @@
+import os
+import sys
+import math
+import time
+import argparse
+import tempfile
+import threading
+
+# Load test for the chatbot endpoints. Runs fully offline: the app uses a temporary
+# database and the fake Gemini model from fake_gemini.py, and requests go through
+# Flask's test client, one per simulated user thread.
+#
+# Usage: python load_test.py --users 20 --messages 5 [--stream] [--latency 0.5]
+#        [--tokens-per-second 50] [--error-rate 0.01] [--rate-limit-rate 0.02]
+
+parser = argparse.ArgumentParser(description="Load test the chatbot endpoints against a fake Gemini model.")
+parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+parser.add_argument("--messages", type=int, default=5, help="chat messages per user after init")
+parser.add_argument("--stream", action="store_true", help="use /api/chatbot/stream instead of /api/chatbot/chat")
+parser.add_argument("--latency", type=float, default=0.5, help="fake model delay before the first token, seconds")
+parser.add_argument("--tokens-per-second", type=float, default=50)
+parser.add_argument("--response-tokens", type=int, default=120)
+parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of model calls failing with a 500")
+parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of model calls failing with a 429")
+args = parser.parse_args()
+
+# Everything the app writes goes to a scratch directory
+scratch = tempfile.mkdtemp(prefix="nestcircle-load-")
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["FAKE_GEMINI_LATENCY"] = str(args.latency)
+os.environ["FAKE_GEMINI_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+os.environ["FAKE_GEMINI_RESPONSE_TOKENS"] = str(args.response_tokens)
+os.environ["FAKE_GEMINI_ERROR_RATE"] = str(args.error_rate)
+os.environ["FAKE_GEMINI_RATE_LIMIT_RATE"] = str(args.rate_limit_rate)
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(scratch, "load.db")
+os.environ["SESSION_FILE_DIR"] = os.path.join(scratch, "sessions")
+os.environ["GEMINI_MODEL_CACHE"] = os.path.join(scratch, "gemini_model.txt")
+
+from werkzeug.security import generate_password_hash
+import chatbot
+from app import app, db, User, Resource, ResourceText
+
+PASSWORD = "load-test"
+
+def rss_mb():
+    """Current resident memory of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current on platforms without /proc; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def setup():
+    """Create the users and a resource whose text is already ingested."""
+    with app.app_context():
+        db.create_all()
+        password = generate_password_hash(PASSWORD, method="pbkdf2:sha256:1000")  # Fast to check
+        users = [User(username=f"load{i}", email=f"load{i}@example.com", password=password, email_verified=True)
+                 for i in range(args.users)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        source = "https://example.com/load-test"
+        resource = Resource(title="Load test resource", description="Generated", resource_type="link",
+                            content=source, user_id=users[0].id)
+        db.session.add(resource)
+        db.session.commit()
+        text = " ".join(f"Paragraph {i} about sorting algorithms, graphs and dynamic programming." for i in range(2000))
+        db.session.add(ResourceText(resource_id=resource.id, status="ready", text=text,
+                                    fingerprint=chatbot.content_fingerprint("link", source)))
+        db.session.commit()
+        return resource.id
+
+# The chat endpoint reports model failures as replies, so they are recognised by their text
+ERROR_REPLY_PREFIXES = ("Error", "Too many requests", "Sorry, there was an issue", "The AI model took too long")
+
+def is_ok(result):
+    return bool(result.get("success")) and not str(result.get("response", "")).startswith(ERROR_REPLY_PREFIXES)
+
+samples = {}  # endpoint -> list of (seconds, ok)
+samples_lock = threading.Lock()
+
+def record(endpoint, seconds, ok):
+    with samples_lock:
+        samples.setdefault(endpoint, []).append((seconds, ok))
+
+def run_user(index, resource_id, start_barrier):
+    client = app.test_client()
+    client.post("/login", data={"email": f"load{index}@example.com", "password": PASSWORD})
+    start_barrier.wait()
+
+    start = time.perf_counter()
+    data = client.post(f"/api/chatbot/init/{resource_id}", json={}).get_json() or {}
+    record("init", time.perf_counter() - start, bool(data.get("success")))
+    if not data.get("success"):
+        return
+
+    for i in range(args.messages):
+        # Distinct prompts so the first-turn response cache does not hide model latency
+        payload = {"session_id": data["session_id"], "prompt": f"Question {i} from user {index}: explain step {i}"}
+        start = time.perf_counter()
+        if args.stream:
+            response = client.post("/api/chatbot/stream", json=payload)
+            first_event = None
+            body = []
+            for chunk in response.response:
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+                body.append(chunk if isinstance(chunk, bytes) else chunk.encode())
+            response.close()
+            ok = b"event: done" in b"".join(body)
+            record("stream (first event)", first_event or 0.0, ok)
+            record("stream (complete)", time.perf_counter() - start, ok)
+        else:
+            result = client.post("/api/chatbot/chat", json=payload).get_json() or {}
+            record("chat", time.perf_counter() - start, is_ok(result))
+
+def monitor(stop, stats):
+    while not stop.is_set():
+        stats["threads"] = max(stats["threads"], threading.active_count())
+        stats["rss"] = max(stats["rss"], rss_mb())
+        stop.wait(0.1)
+
+resource_id = setup()
+# Wait for the background model initialization to pick up the fake
+while chatbot.model_status in ("idle", "initializing"):
+    time.sleep(0.05)
+
+baseline_threads, baseline_rss = threading.active_count(), rss_mb()
+stats = {"threads": baseline_threads, "rss": baseline_rss}
+stop = threading.Event()
+monitor_thread = threading.Thread(target=monitor, args=(stop, stats), daemon=True)
+monitor_thread.start()
+
+barrier = threading.Barrier(args.users + 1)
+users = [threading.Thread(target=run_user, args=(i, resource_id, barrier)) for i in range(args.users)]
+for user in users:
+    user.start()
+barrier.wait()
+started = time.perf_counter()
+for user in users:
+    user.join()
+elapsed = time.perf_counter() - started
+stop.set()
+monitor_thread.join()
+
+print(f"\n{args.users} users x {args.messages} messages, {'streaming' if args.stream else 'JSON'} chat, "
+      f"fake model latency {args.latency}s at {args.tokens_per_second:g} tokens/s")
+print(f"Gemini pool: {chatbot.GEMINI_MAX_WORKERS} workers, {chatbot.GEMINI_MAX_QUEUED} queued\n")
+print(f"{'endpoint':22s} {'requests':>8s} {'errors':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s}")
+total = 0
+for endpoint, values in samples.items():
+    latencies = [seconds for seconds, _ in values]
+    errors = sum(1 for _, ok in values if not ok)
+    if not endpoint.endswith("(first event)"):
+        total += len(values)
+    print(f"{endpoint:22s} {len(values):8d} {errors:7d} "
+          f"{percentile(latencies, 50):7.3f}s {percentile(latencies, 95):7.3f}s {percentile(latencies, 99):7.3f}s")
+
+print(f"\nThroughput: {total / elapsed:.1f} requests/s over {elapsed:.1f}s")
+print(f"Threads: {baseline_threads} before, {stats['threads']} peak, {threading.active_count()} after")
+print(f"Memory: {baseline_rss:.0f} MB before, {stats['rss']:.0f} MB peak, {rss_mb():.0f} MB after")
+print(f"Gemini pool stats: {chatbot.get_gemini_stats()}")
+print(f"Scratch files left in {scratch}")
@@ -4,11 +4,15 @@ document.addEventListener('DOMContentLoaded', function() {
     let chatSessionId = null;
     let chatbotInitialized = false;
     let isFullscreen = false;
+    let initAttempts = 0;
+    const maxInitAttempts = 20; // Give background text extraction about a minute
+    const initRetryDelay = 3000;
     
     // Available slash commands
     const slashCommands = [
         { command: '/summarize', description: 'Summarize the content' },
         { command: '/quiz', description: 'Generate a quiz based on content' },
+        { command: '/pages', description: 'Focus on a page range of a PDF (e.g. /pages 10-25)' },
         { command: '/help', description: 'Show available commands' }
     ];
 
@@ -47,6 +51,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     <strong>Pro tip:</strong> Try special commands:
                     <br><code>/summarize</code> - Summarize the content
                     <br><code>/quiz [options]</code> - Generate a quiz (e.g., '/quiz make 5 questions about chapter 2')
+                    <br><code>/pages 10-25</code> - Focus on specific pages of a PDF
                     <br><code>/help</code> - Show available commands
                 </div>
             </div>
@@ -220,7 +225,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    function initializeChatbot() {
+    function initializeChatbot(pageRange = null) {
         const messageContainer = document.getElementById('chatbot-messages');
         
         // Show loading message
@@ -246,7 +251,8 @@ document.addEventListener('DOMContentLoaded', function() {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-            }
+            },
+            body: JSON.stringify(pageRange || {})
         })
         .then(response => response.json())
         .then(data => {
@@ -256,6 +262,19 @@ document.addEventListener('DOMContentLoaded', function() {
             // Remove loading message
             messageContainer.removeChild(loadingMessage);
             
+            // The resource text is still being extracted in the background, poll again shortly
+            if (data.pending && initAttempts < maxInitAttempts) {
+                initAttempts++;
+                if (initAttempts === 1) {
+                    const pendingMessage = document.createElement('div');
+                    pendingMessage.className = 'chat-message bot-message hint-message';
+                    pendingMessage.textContent = "I'm still reading this resource. This can take a moment for large files...";
+                    messageContainer.appendChild(pendingMessage);
+                }
+                setTimeout(() => initializeChatbot(pageRange), initRetryDelay);
+                return;
+            }
+            
             if (data.success) {
                 chatSessionId = data.session_id;
                 chatbotInitialized = true;
@@ -276,6 +295,10 @@ document.addEventListener('DOMContentLoaded', function() {
                         resourceTypeMessage = "I've analyzed the resource. What would you like to know about it?";
                 }
                 
+                if (data.page_range) {
+                    resourceTypeMessage = `I've read pages ${data.page_range[0]}-${data.page_range[1]} of the PDF. What would you like to know about them?`;
+                }
+                
                 const typeMessage = document.createElement('div');
                 typeMessage.className = 'chat-message bot-message';
                 typeMessage.textContent = resourceTypeMessage;
@@ -347,6 +370,21 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        // Re-initialize the session on a page range of the PDF
+        if (userMessage.startsWith('/pages')) {
+            const match = userMessage.match(/^\/pages\s+(\d+)(?:\s*-\s*(\d+))?/);
+            
+            const userMessageElement = document.createElement('div');
+            userMessageElement.className = 'chat-message user-message';
+            userMessageElement.textContent = userMessage;
+            document.getElementById('chatbot-messages').appendChild(userMessageElement);
+            inputField.value = '';
+            
+            initAttempts = 0;
+            initializeChatbot(match ? { start_page: parseInt(match[1]), end_page: parseInt(match[2] || match[1]) } : null);
+            return;
+        }
+        
         // Check for special commands
         if (userMessage.startsWith('/summarize')) {
             // Extract any additional parameters after /summarize
@@ -394,6 +432,7 @@ document.addEventListener('DOMContentLoaded', function() {
             <strong>Available Commands:</strong><br>
             <code>/summarize [focus]</code> - Summarize the content, optionally with a specific focus<br>
             <code>/quiz [options]</code> - Generate a quiz based on the content<br>
+            <code>/pages start-end</code> - Focus on a page range of a PDF (<code>/pages</code> alone resets to the whole document)<br>
             Examples:<br>
             <code>/summarize key concepts</code> - Summarize focusing on key concepts<br>
             <code>/quiz make 10 multiple choice questions about chapter 3</code> - Create a specific quiz
@@ -438,8 +477,8 @@ document.addEventListener('DOMContentLoaded', function() {
         // Use processed message if provided, otherwise use original message
         const messageToSend = processedMessage || userMessage;
         
-        // Send message to server
-        fetch('/api/chatbot/chat', {
+        // Send message to server, the response streams back as Server-Sent Events
+        fetch('/api/chatbot/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -449,59 +488,93 @@ document.addEventListener('DOMContentLoaded', function() {
                 prompt: messageToSend
             })
         })
-        .then(response => response.json())
-        .then(data => {
-            // Clear timeout
-            clearTimeout(timeoutWarning);
+        .then(response => {
+            const contentType = response.headers.get('Content-Type') || '';
             
-            // Remove loading indicator
-            messageContainer.removeChild(loadingMessage);
+            // Errors found before streaming starts come back as plain JSON
+            if (!contentType.includes('text/event-stream') || !response.body) {
+                return response.json().then(data => {
+                    clearTimeout(timeoutWarning);
+                    messageContainer.removeChild(loadingMessage);
+                    if (data.success) {
+                        showBotResponse(data.response);
+                    } else {
+                        showBotError(data.error);
+                    }
+                });
+            }
             
-            if (data.success) {
-                // Format response with markdown
-                const formattedResponse = formatBotResponse(data.response);
-                
-                // Add bot response to chat
-                const botMessageElement = document.createElement('div');
-                botMessageElement.className = 'chat-message bot-message';
-                botMessageElement.innerHTML = formattedResponse;
-                messageContainer.appendChild(botMessageElement);
-            } else {
-                // Display specific error message from server
-                const errorMsg = data.error || "Sorry, I couldn't process your request. Please try again.";
-                
-                const errorMessage = document.createElement('div');
-                errorMessage.className = 'chat-message bot-message error-message';
-                errorMessage.textContent = errorMsg;
-                messageContainer.appendChild(errorMessage);
-                
-                // Show retry suggestion if it looks like a temporary error
-                if (errorMsg.includes("encountered an error") || errorMsg.includes("try again")) {
-                    const retryMessage = document.createElement('div');
-                    retryMessage.className = 'chat-message bot-message hint-message';
-                    retryMessage.textContent = "This might be a temporary issue. You can try asking again in a moment.";
-                    messageContainer.appendChild(retryMessage);
-                }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let responseText = '';
+            let botMessageElement = null;
+            
+            function handleEvent(rawEvent) {
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventName = line.substring(7);
+                    else if (line.startsWith('data: ')) data += line.substring(6);
+                });
+                const payload = data ? JSON.parse(data) : {};
                 
-                // Add configuration hint if it's an API key issue
-                if (errorMsg.includes("API key")) {
-                    const configHint = document.createElement('div');
-                    configHint.className = 'chat-message bot-message hint-message';
-                    configHint.innerHTML = "It looks like the AI service is not configured properly. " +
-                        "Please make sure you have set up a valid Gemini API key in the server's .env file.";
-                    messageContainer.appendChild(configHint);
+                if (eventName === 'message') {
+                    // Swap the typing indicator for the response on the first chunk
+                    if (!botMessageElement) {
+                        clearTimeout(timeoutWarning);
+                        messageContainer.removeChild(loadingMessage);
+                        botMessageElement = document.createElement('div');
+                        botMessageElement.className = 'chat-message bot-message';
+                        messageContainer.appendChild(botMessageElement);
+                    }
+                    responseText += payload.text;
+                    botMessageElement.innerHTML = formatBotResponse(responseText);
+                    messageContainer.scrollTop = messageContainer.scrollHeight;
+                } else if (eventName === 'error') {
+                    if (!botMessageElement) {
+                        clearTimeout(timeoutWarning);
+                        messageContainer.removeChild(loadingMessage);
+                    }
+                    showBotError(payload.error);
                 }
             }
             
-            // Scroll to bottom
-            messageContainer.scrollTop = messageContainer.scrollHeight;
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        if (buffer.trim()) handleEvent(buffer);
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    // Events are separated by a blank line
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        handleEvent(buffer.substring(0, boundary));
+                        buffer = buffer.substring(boundary + 2);
+                    }
+                    return read();
+                });
+            }
+            
+            return read().then(() => {
+                // The stream ended without any output or error event
+                if (!botMessageElement && loadingMessage.parentNode) {
+                    clearTimeout(timeoutWarning);
+                    messageContainer.removeChild(loadingMessage);
+                    showBotError(null);
+                }
+            });
         })
         .catch(error => {
             // Clear timeout
             clearTimeout(timeoutWarning);
             
             // Remove loading indicator
-            messageContainer.removeChild(loadingMessage);
+            if (loadingMessage.parentNode) {
+                messageContainer.removeChild(loadingMessage);
+            }
             
             console.error('Error sending message:', error);
             const errorMessage = document.createElement('div');
@@ -513,6 +586,53 @@ document.addEventListener('DOMContentLoaded', function() {
             messageContainer.scrollTop = messageContainer.scrollHeight;
         });
     }
+    
+    // Add a complete bot response to the chat
+    function showBotResponse(text) {
+        const messageContainer = document.getElementById('chatbot-messages');
+        
+        // Format response with markdown
+        const botMessageElement = document.createElement('div');
+        botMessageElement.className = 'chat-message bot-message';
+        botMessageElement.innerHTML = formatBotResponse(text);
+        messageContainer.appendChild(botMessageElement);
+        
+        // Scroll to bottom
+        messageContainer.scrollTop = messageContainer.scrollHeight;
+    }
+    
+    // Add an error from the server to the chat, with hints for common problems
+    function showBotError(error) {
+        const messageContainer = document.getElementById('chatbot-messages');
+        
+        // Display specific error message from server
+        const errorMsg = error || "Sorry, I couldn't process your request. Please try again.";
+        
+        const errorMessage = document.createElement('div');
+        errorMessage.className = 'chat-message bot-message error-message';
+        errorMessage.textContent = errorMsg;
+        messageContainer.appendChild(errorMessage);
+        
+        // Show retry suggestion if it looks like a temporary error
+        if (errorMsg.includes("encountered an error") || errorMsg.includes("try again")) {
+            const retryMessage = document.createElement('div');
+            retryMessage.className = 'chat-message bot-message hint-message';
+            retryMessage.textContent = "This might be a temporary issue. You can try asking again in a moment.";
+            messageContainer.appendChild(retryMessage);
+        }
+        
+        // Add configuration hint if it's an API key issue
+        if (errorMsg.includes("API key")) {
+            const configHint = document.createElement('div');
+            configHint.className = 'chat-message bot-message hint-message';
+            configHint.innerHTML = "It looks like the AI service is not configured properly. " +
+                "Please make sure you have set up a valid Gemini API key in the server's .env file.";
+            messageContainer.appendChild(configHint);
+        }
+        
+        // Scroll to bottom
+        messageContainer.scrollTop = messageContainer.scrollHeight;
+    }
 
     // Helper function to format bot responses with code blocks and basic markdown
     function formatBotResponse(text) {
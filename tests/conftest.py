@@ -0,0 +1,44 @@
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+# The app reads its configuration at import, so point it at scratch storage first
+_scratch = tempfile.mkdtemp(prefix="nestcircle-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_scratch, "test.db")
+os.environ["SESSION_FILE_DIR"] = os.path.join(_scratch, "sessions")
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["GEMINI_MODEL_CACHE"] = os.path.join(_scratch, "gemini_model.txt")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, migrate_database  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app with a freshly created database, inside an app context."""
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        db.drop_all()
+        # The search index is not one of the models, so drop_all leaves it behind
+        db.session.execute(db.text("DROP TABLE IF EXISTS resource_fts"))
+        db.session.commit()
+        migrate_database()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def user(app):
+    from app import User
+    account = User(username="tester", email="tester@example.com", password="x", email_verified=True)
+    db.session.add(account)
+    db.session.commit()
+    return account
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_scratch, ignore_errors=True)
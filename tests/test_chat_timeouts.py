@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import chatbot
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace call_gemini with a stand-in that plays back `outcomes` and records the timeouts it was given."""
+    log = []
+    outcomes = []
+
+    class Response:
+        text = "Binary search needs sorted input."
+
+    def fake_call(make_call, timeout, user=None, tokens=None):
+        log.append((make_call.__name__, timeout))
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, float):
+            time.sleep(outcome)
+            raise chatbot.TimeoutError("Function call timed out")
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response()
+
+    monkeypatch.setattr(chatbot, "model", object())
+    monkeypatch.setattr(chatbot, "model_works", True)
+    monkeypatch.setattr(chatbot, "call_gemini", fake_call)
+    return log, outcomes
+
+
+def test_fallback_gets_only_the_remaining_time(calls):
+    log, outcomes = calls
+    outcomes += [0.5, "ok"]
+
+    text, _ = chatbot.chat_with_gemini("What does binary search need?", chat_history=[{"role": "user", "parts": ["hi"]}],
+                                       timeout=3)
+
+    assert text == "Binary search needs sorted input."
+    assert [name for name, _ in log] == ["send_message", "generate_content"]
+    assert log[1][1] <= 3 - 0.5
+
+
+def test_no_fallback_when_the_deadline_has_passed(calls):
+    log, outcomes = calls
+    outcomes += [0.6, "ok"]
+
+    text, _ = chatbot.chat_with_gemini("What does binary search need?", timeout=1)
+
+    assert "took too long" in text
+    assert len(log) == 1
+
+
+def test_no_fallback_after_a_rate_limit_wait_times_out(calls):
+    log, outcomes = calls
+    outcomes += [chatbot.RateLimitTimeoutError("Timed out waiting for the AI request rate limit"), "ok"]
+
+    text, _ = chatbot.chat_with_gemini("What does binary search need?", timeout=30)
+
+    assert "took too long" in text
+    assert len(log) == 1
@@ -0,0 +1,18 @@
+import pytest
+
+import chatbot
+
+CONTENT = "Binary search halves the search range on every step. " * 10
+PAGES = {
+    "main": f"<html><body><nav>Home</nav><main><p>{CONTENT}</p></main><aside>Related posts</aside></body></html>",
+    "role": f"<html><body><div role='main'><p>{CONTENT}</p></div><aside>Related posts</aside></body></html>",
+    "main role=main": f"<html><body><main role='main'><p>{CONTENT}</p></main><aside>Related posts</aside></body></html>",
+    "article": f"<html><body><article><p>{CONTENT}</p></article><aside>Related posts</aside></body></html>",
+}
+
+
+@pytest.mark.parametrize("engine", sorted(chatbot.HTML_EXTRACTORS))
+@pytest.mark.parametrize("page", sorted(PAGES))
+def test_main_content_is_preferred(engine, page):
+    text = chatbot.html_to_text(PAGES[page], engine=engine)
+    assert text == CONTENT.strip()
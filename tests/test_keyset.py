@@ -0,0 +1,104 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, Resource, RESOURCE_SORTS, encode_cursor, decode_cursor, keyset_paginate, listing_query
+
+START = datetime(2024, 1, 1, 9, 0)
+
+
+@pytest.fixture
+def resources(app, user):
+    """25 resources, some posted at the same moment and some with equal ratings, so ties need the id."""
+    rows = []
+    for i in range(25):
+        count = i % 4
+        rows.append(Resource(title=f"Notes {i}", description="Sorting", resource_type="link",
+                             content=f"https://example.com/{i}", user_id=user.id,
+                             date_posted=START + timedelta(hours=i // 3),
+                             rating_count=count, rating_sum=count * (i % 5 + 1)))
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def walk(keys, per_page=4):
+    """Follow next cursors to the end, then prev cursors back to the start; returns both lists of pages."""
+    forward, backward = [], []
+    page = keyset_paginate(listing_query(), Resource, keys, None, per_page)
+    forward.append([r.id for r in page])
+    while page.has_next:
+        page = keyset_paginate(listing_query(), Resource, keys, page.next_cursor, per_page)
+        forward.append([r.id for r in page])
+    backward.append([r.id for r in page])
+    while page.has_prev:
+        page = keyset_paginate(listing_query(), Resource, keys, page.prev_cursor, per_page)
+        backward.append([r.id for r in page])
+    return forward, backward
+
+
+@pytest.mark.parametrize("sort", sorted(RESOURCE_SORTS))
+def test_forward_and_back_round_trip(resources, sort):
+    keys = RESOURCE_SORTS[sort]
+    expected = [r.id for r in listing_query().order_by(*[getattr(Resource, key).desc() for key in keys])]
+
+    forward, backward = walk(keys)
+
+    assert [i for page in forward for i in page] == expected
+    assert backward == list(reversed(forward))
+
+
+def test_cursor_round_trip_keeps_types(resources):
+    cursor = encode_cursor('next', [START, 2.5, 3, 17])
+    assert decode_cursor(cursor) == ('next', [START, 2.5, 3, 17])
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    raw_cursor("next"),
+    raw_cursor(["sideways", [{"dt": "2024-01-01T12:00:00"}, 3]]),
+    raw_cursor(["next", [{"dt": "2024-01-01T12:00:00"}]]),              # too few values
+    raw_cursor(["next", [{"dt": "2024-01-01T12:00:00"}, 3, 4]]),        # too many values
+    raw_cursor(["next", ["2024-01-01T12:00:00", 3]]),                   # str for a datetime
+    raw_cursor(["next", [1704106800, 3]]),                              # int for a datetime
+    raw_cursor(["next", [{"dt": "yesterday"}, 3]]),
+    raw_cursor(["next", [{"dt": "2024-01-01T12:00:00"}, "3"]]),         # str for an id
+    raw_cursor(["next", [{"dt": "2024-01-01T12:00:00"}, 3.5]]),         # float for an id
+    raw_cursor(["next", [{"dt": "2024-01-01T12:00:00"}, True]]),
+    raw_cursor(["next", [{"dt": "2024-01-01T12:00:00"}, 2 ** 70]]),     # beyond SQLite integers
+    raw_cursor(["prev", [{"dt": "2024-01-01T12:00:00"}, {"id": 3}]]),
+])
+def test_tampered_cursor_gives_the_first_page(resources, cursor):
+    keys = RESOURCE_SORTS['newest']
+    first = keyset_paginate(listing_query(), Resource, keys, None, 4)
+
+    page = keyset_paginate(listing_query(), Resource, keys, cursor, 4)
+
+    assert [r.id for r in page] == [r.id for r in first]
+    assert not page.has_prev
+
+
+def test_tampered_cursor_on_a_float_key(resources):
+    keys = RESOURCE_SORTS['top_rated']
+    first = keyset_paginate(listing_query(), Resource, keys, None, 4)
+
+    for values in (["high", 3, {"dt": "2024-01-01T12:00:00"}, 5], [4, 3, {"dt": "2024-01-01T12:00:00"}, 5, 6]):
+        page = keyset_paginate(listing_query(), Resource, keys, raw_cursor(["next", values]), 4)
+        assert [r.id for r in page] == [r.id for r in first]
+
+    # Whole numbers are fine where the average rating is expected
+    page = keyset_paginate(listing_query(), Resource, keys, raw_cursor(["next", [4, 3, {"dt": "2030-01-01T00:00:00"}, 99]]), 4)
+    assert all(r.avg_rating <= 4 for r in page)
+
+
+@pytest.mark.parametrize("sort", sorted(RESOURCE_SORTS))
+def test_home_survives_tampered_cursors(app, resources, sort):
+    client = app.test_client()
+    for cursor in (raw_cursor(["next", ["2024", "x", None, []]]), raw_cursor(["next", [{"dt": "2024-01-01"}]])):
+        assert client.get(f"/?sort={sort}&cursor={cursor}").status_code == 200
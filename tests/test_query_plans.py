@@ -0,0 +1,40 @@
+import pytest
+
+from app import db, create_missing_indexes, explain_query_plan, hot_queries, is_full_scan
+
+# Listings over the whole table, which must come straight off an index in sort order
+INDEX_ORDERED = ('home', 'home, later page', 'home, most rated', 'home, top rated', 'home, top rated later page')
+
+
+@pytest.fixture
+def indexed(app):
+    """A scratch database that lacks the declared indexes until create_missing_indexes adds them back."""
+    declared = {index.name for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in declared:
+        db.session.execute(db.text(f"DROP INDEX IF EXISTS {name}"))
+    db.session.commit()
+
+    assert set(create_missing_indexes()) == declared
+    assert create_missing_indexes() == []
+
+
+def test_hot_queries_cover_the_listing_sorts(app):
+    names = {name for name, _ in hot_queries()}
+    assert {'home', 'home, most rated', 'home, top rated'} <= names
+
+
+
+
+def test_no_hot_query_scans_a_whole_table(app, indexed):
+    full_scans = {}
+    for name, query in hot_queries():
+        scans = [detail for detail in explain_query_plan(query) if is_full_scan(detail)]
+        if scans:
+            full_scans[name] = scans
+    assert full_scans == {}
+
+
+def test_listings_are_read_in_index_order(app, indexed):
+    plans = {name: explain_query_plan(query) for name, query in hot_queries()}
+    for name in INDEX_ORDERED:
+        assert not any('TEMP B-TREE' in detail for detail in plans[name]), (name, plans[name])
@@ -0,0 +1,74 @@
+import re
+
+import app as nestcircle
+from app import db, Resource, User
+
+
+def titles(response):
+    return re.findall(r'<h5 class="card-title">(.*?)</h5>', response.get_data(as_text=True))
+
+
+def next_cursor(response):
+    links = re.findall(r'href="([^"]*cursor=[^"]*)"[^>]*>\s*Next', response.get_data(as_text=True))
+    return links[0].replace("&amp;", "&") if links else None
+
+
+def add_resources(user, count):
+    for i in range(count):
+        words = "binary search " * (i % 4 + 1)
+        db.session.add(Resource(title=f"Notes {i}", description=f"{words}over sorted arrays", resource_type="link",
+                                content=f"https://example.com/{i}", user_id=user.id))
+    db.session.commit()
+
+
+def test_first_request_creates_the_search_index(app):
+    # A database made by create_all alone, as by an entry point other than app.py's __main__
+    db.drop_all()
+    db.session.execute(db.text("DROP TABLE resource_fts"))
+    db.session.commit()
+    db.create_all()
+    user = User(username="tester", email="tester@example.com", password="x")
+    db.session.add(user)
+    db.session.commit()
+    nestcircle._database_ready = False
+    nestcircle._search_index_ready = False
+    add_resources(user, 3)
+
+    response = app.test_client().get("/search?query=binary")
+
+    assert response.status_code == 200
+    assert nestcircle.search_index_available()
+    assert sorted(titles(response)) == ["Notes 0", "Notes 1", "Notes 2"]
+
+
+def test_relevance_pages_cover_every_match_once(app, user):
+    add_resources(user, 30)
+    client = app.test_client()
+
+    response = client.get("/search?query=binary")
+    assert "Found 30 resource(s)" in response.get_data(as_text=True)
+    seen = titles(response)
+    url = next_cursor(response)
+    while url:
+        response = client.get(url)
+        assert "Found" not in response.get_data(as_text=True)
+        seen += titles(response)
+        url = next_cursor(response)
+
+    assert len(seen) == 30
+    assert set(seen) == {f"Notes {i}" for i in range(30)}
+    # Resources repeating the words more rank higher and come first
+    first_page = seen[:nestcircle.SEARCH_RESULTS_PER_PAGE]
+    assert all(int(title.split()[1]) % 4 == 3 for title in first_page[:7])
+
+
+def test_other_sorts_page_by_keyset(app, user):
+    add_resources(user, 15)
+    client = app.test_client()
+
+    response = client.get("/search?query=binary&sort=newest")
+    seen = titles(response)
+    response = client.get(next_cursor(response))
+    seen += titles(response)
+
+    assert seen == [f"Notes {i}" for i in reversed(range(15))]
@@ -0,0 +1,123 @@
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import chatbot
+from app import db, Resource, ingest_resource_text
+
+PAGE = b"<html><body><main><h1>Lecture notes</h1><p>Binary search halves the range.</p></main></body></html>"
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Serves whatever the test puts in `responses`, one per request, and records the request headers."""
+    responses = []
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        status, headers, body = type(self).responses.pop(0)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandIn.responses = []
+    StandIn.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield StandIn, f"http://127.0.0.1:{httpd.server_port}/notes"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def html(body=PAGE, **headers):
+    return 200, dict({"Content-Type": "text/html; charset=utf-8", "Content-Length": str(len(body))}, **headers), body
+
+
+def test_revalidation_uses_stored_validators(server):
+    handler, url = server
+    handler.responses = [html(ETag='"v1"'), (304, {"ETag": '"v1"'}, b"")]
+
+    text, validators = chatbot.fetch_webpage_text(url)
+    assert "Binary search halves the range." in text
+    assert validators["etag"] == '"v1"'
+
+    text, validators = chatbot.fetch_webpage_text(url, etag=validators["etag"])
+    assert text is None
+    assert validators["etag"] == '"v1"'
+    assert handler.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_non_html_content_type_is_rejected(server):
+    handler, url = server
+    handler.responses = [(200, {"Content-Type": "application/pdf", "Content-Length": "9"}, b"%PDF-1.4\n")]
+
+    text, validators = chatbot.fetch_webpage_text(url)
+    assert text.startswith("Error")
+    assert "application/pdf" in text
+    assert validators == {}
+
+
+@pytest.mark.parametrize("declare_length", [True, False])
+def test_pages_over_the_byte_cap_are_rejected(server, monkeypatch, declare_length):
+    handler, url = server
+    monkeypatch.setattr(chatbot, "MAX_WEBPAGE_BYTES", 1024)
+    body = b"<html><body>" + b"<p>filler</p>" * 1000 + b"</body></html>"
+    headers = {"Content-Type": "text/html"}
+    if declare_length:
+        headers["Content-Length"] = str(len(body))
+    handler.responses = [(200, headers, body)]
+
+    text, _ = chatbot.fetch_webpage_text(url)
+    assert text == "Error: Webpage is larger than 1024 bytes."
+
+
+def make_link(user, url):
+    resource = Resource(title="Notes", description="Search", resource_type="link", content=url, user_id=user.id)
+    db.session.add(resource)
+    db.session.commit()
+    return resource
+
+
+def test_ingestion_keeps_text_when_the_page_is_unchanged(app, user, server):
+    handler, url = server
+    handler.responses = [html(ETag='"v1"'), (304, {"ETag": '"v1"'}, b"")]
+    resource = make_link(user, url)
+
+    ingest_resource_text(app, resource.id)
+    db.session.expire_all()
+    resource.extracted_text.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    ingest_resource_text(app, resource.id)
+    db.session.expire_all()
+
+    record = resource.extracted_text
+    assert record.status == "ready"
+    assert "Binary search halves the range." in record.text
+    assert handler.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_ingestion_refetches_a_304_without_stored_text(app, user, server):
+    handler, url = server
+    handler.responses = [(304, {}, b""), html()]
+    resource = make_link(user, url)
+
+    ingest_resource_text(app, resource.id)
+    db.session.expire_all()
+
+    record = resource.extracted_text
+    assert record.status == "ready"
+    assert "Binary search halves the range." in record.text
+    assert len(handler.requests) == 2
+    assert "If-None-Match" not in handler.requests[1]